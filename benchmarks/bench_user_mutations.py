@@ -0,0 +1,89 @@
+'''
+FastAPI Demo
+
+Benchmark - user mutations
+
+Compares the old read-modify-write path (existence check, ORM load, change, commit)
+with the single UPDATE ... RETURNING path in utils/user_utils. Needs the configured
+database. Run from the repository root:
+> python -m benchmarks.bench_user_mutations --iterations 500
+'''
+# Standard Imports
+import argparse
+import statistics
+import time
+
+# Local Imports
+from database import models
+from database.setup import session_local
+from data_schemas import schemas
+import utils.user_utils as user_utils
+
+###############################################################################
+
+SCRATCH_USERNAME = 'bench_mutation_user'
+
+###############################################################################
+
+def legacy_set_user_admin(database, user_id: int, admin: bool):
+	'''The pre-RETURNING write path: router existence check, then load, modify and commit'''
+	if not database.query(models.User).filter(models.User.user_id == user_id).first():
+		return None
+	user = database.query(models.User).filter(models.User.user_id == user_id).first()
+	user.admin_boolean = admin
+	database.add(user)
+	database.commit()
+	return user
+
+def time_calls(function, iterations: int):
+	'''Time repeated calls of function(iteration), returning per-call latencies in milliseconds'''
+	latencies = []
+	for iteration in range(iterations):
+		start = time.perf_counter()
+		function(iteration)
+		latencies.append((time.perf_counter() - start) * 1000)
+	return latencies
+
+def summarize(name: str, latencies: list):
+	'''Print mean and percentile latencies'''
+	ordered = sorted(latencies)
+	print('{name:<28} mean {mean:7.3f} ms  p50 {p50:7.3f} ms  p95 {p95:7.3f} ms'.format(
+		name=name,
+		mean=statistics.mean(ordered),
+		p50=ordered[len(ordered) // 2],
+		p95=ordered[int(len(ordered) * 0.95) - 1]
+	))
+
+def main():
+	'''Main Function'''
+	parser = argparse.ArgumentParser(description='Compare user mutation write paths')
+	parser.add_argument('--iterations', type=int, default=500)
+	args = parser.parse_args()
+	database = session_local()
+	try:
+		user = user_utils.get_user_by_username(database, SCRATCH_USERNAME)
+		if not user:
+			user = user_utils.create_user(database=database, user=schemas.UserCreate(
+				username=SCRATCH_USERNAME,
+				first_name='Bench',
+				last_name='User',
+				email='{username}@test.ca'.format(username=SCRATCH_USERNAME),
+				password='bench_password'
+			))
+		user_id = user.user_id
+		summarize('legacy read-modify-write', time_calls(
+			lambda iteration: legacy_set_user_admin(database, user_id, bool(iteration % 2)),
+			args.iterations
+		))
+		summarize('UPDATE ... RETURNING', time_calls(
+			lambda iteration: user_utils.set_user_admin(database, user_id, bool(iteration % 2)),
+			args.iterations
+		))
+		user_utils.delete_user(database, user_id)
+	finally:
+		database.close()
+
+###############################################################################
+
+if __name__ == '__main__':
+	main()
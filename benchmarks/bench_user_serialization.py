@@ -0,0 +1,83 @@
+'''
+FastAPI Demo
+
+Benchmark - user list serialization
+
+Compares the default response path for GET /users/ (rows validated through
+schemas.User in orm_mode, jsonable_encoder, stdlib json) with the FAST_JSON_RESPONSES
+path (the same rows encoded straight to bytes with orjson). Both paths get the
+SQLAlchemy Row objects user_utils.get_users returns, read from an in-memory SQLite
+copy of the users table, so no database server is needed.
+Run from the repository root:
+> python -m benchmarks.bench_user_serialization
+'''
+# Standard Imports
+import argparse
+import json
+import timeit
+
+# PyPi Imports
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import (
+	create_engine,
+	insert,
+	select
+)
+
+# Local Imports
+from data_schemas import schemas
+from database import models
+from utils.response_utils import encode_user_rows
+from utils.user_utils import USER_COLUMNS
+
+###############################################################################
+
+def load_rows(count: int):
+	'''User rows as get_users returns them: Row objects of USER_COLUMNS, ordered by user_id'''
+	engine = create_engine('sqlite://')
+	models.User.__table__.create(engine)
+	with engine.begin() as connection:
+		if count:
+			connection.execute(insert(models.User), [
+				{
+					'username': 'user{number}'.format(number=number),
+					'first_name': 'First',
+					'last_name': 'Last',
+					'email': 'user{number}@test.ca'.format(number=number),
+					'salted_password_hash': 'unused'
+				}
+				for number in range(count)
+			])
+		rows = connection.execute(select(*USER_COLUMNS).order_by(models.User.user_id)).all()
+	engine.dispose()
+	return rows
+
+def pydantic_path(rows: list):
+	'''What FastAPI does for response_model=List[schemas.User] with rows in orm_mode'''
+	validated = [schemas.User.from_orm(row) for row in rows]
+	return json.dumps(jsonable_encoder(validated)).encode('utf-8')
+
+def main():
+	'''Main Function'''
+	parser = argparse.ArgumentParser(description='Compare user list serialization paths')
+	parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 10000])
+	parser.add_argument('--repeat', type=int, default=5)
+	args = parser.parse_args()
+	for size in args.sizes:
+		rows = load_rows(size)
+		number = max(1, 10000 // size)
+		results = {
+			'pydantic + json': min(timeit.repeat(lambda rows=rows: pydantic_path(rows), number=number, repeat=args.repeat)),
+			'rows + orjson': min(timeit.repeat(lambda rows=rows: encode_user_rows(rows), number=number, repeat=args.repeat))
+		}
+		for name, best in results.items():
+			print('{size:>6} rows  {name:<16} {per_call:10.3f} ms/response'.format(
+				size=size,
+				name=name,
+				per_call=best / number * 1000
+			))
+
+###############################################################################
+
+if __name__ == '__main__':
+	main()
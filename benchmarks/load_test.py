@@ -0,0 +1,230 @@
+'''
+FastAPI Demo
+
+Load test - token and users endpoints
+
+Drives a running instance with concurrent scripted clients and reports requests
+per second and p50/p95/p99 latency per route as JSON, so runs can be diffed.
+Scenarios:
+* login_storm: every client posts credentials to /token as fast as it can
+* directory_browse: read-heavy paging through /users/, searches and single user reads
+* mixed_crud: each iteration creates, reads, updates, deactivates and deletes a user
+The credentials default to the initial user from configuration/initial_user.cfg, the
+admin that create_initial_user.py adds to the server's database (the testing.cfg users
+only exist inside the test schemas); without that file --username and --password are
+required. mixed_crud needs an admin. POST /token is rate limited per IP and username (see LOGIN_* in
+security.cfg), so raise those limits to measure raw login throughput rather than 429s.
+Run from the repository root against a running server:
+> python -m benchmarks.load_test --scenario directory_browse --concurrency 50 --duration 30 --output browse.json
+'''
+# Standard Imports
+import argparse
+import asyncio
+from collections import defaultdict
+import json
+import math
+import time
+import uuid
+
+# PyPi Imports
+import httpx
+
+# Local Imports
+from utils.config_utils import get_config
+
+###############################################################################
+
+CONFIG = get_config('initial_user.cfg')
+INITIAL_USER = CONFIG['initial_user'] if CONFIG.has_section('initial_user') else {}
+
+###############################################################################
+
+class LoadRecorder:
+	'''Latencies and status codes per route for one run'''
+	def __init__(self):
+		self.latencies = defaultdict(list)
+		self.statuses = defaultdict(lambda: defaultdict(int))
+		self.errors = defaultdict(int)
+
+	async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs):
+		'''Send a request, recording it against its route template; transport errors return None'''
+		start = time.perf_counter()
+		try:
+			response = await client.request(method, url, **kwargs)
+		except httpx.HTTPError as exc:
+			self.statuses[route][type(exc).__name__] += 1
+			self.errors[route] += 1
+			self.latencies[route].append(time.perf_counter() - start)
+			return None
+		self.latencies[route].append(time.perf_counter() - start)
+		self.statuses[route][str(response.status_code)] += 1
+		if response.status_code >= 400:
+			self.errors[route] += 1
+		return response
+
+	def report(self, elapsed: float):
+		'''Summarize the run per route and in total'''
+		routes = dict()
+		for route, latencies in sorted(self.latencies.items()):
+			routes[route] = dict(
+				summarize_latencies(latencies),
+				requests=len(latencies),
+				errors=self.errors[route],
+				rps=round(len(latencies) / elapsed, 2),
+				statuses=dict(self.statuses[route])
+			)
+		every_latency = [latency for latencies in self.latencies.values() for latency in latencies]
+		return {
+			'elapsed_seconds': round(elapsed, 3),
+			'total': dict(
+				summarize_latencies(every_latency),
+				requests=len(every_latency),
+				errors=sum(self.errors.values()),
+				rps=round(len(every_latency) / elapsed, 2)
+			),
+			'routes': routes
+		}
+
+
+def percentile(ordered: list, fraction: float):
+	'''Nearest-rank percentile of an already sorted list'''
+	if not ordered:
+		return None
+	rank = max(1, math.ceil(fraction * len(ordered)))
+	return ordered[rank - 1]
+
+def summarize_latencies(latencies: list):
+	'''Latency percentiles in milliseconds'''
+	ordered = sorted(latencies)
+	def milliseconds(value):
+		return None if value is None else round(value * 1000, 3)
+	return {
+		'p50_ms': milliseconds(percentile(ordered, 0.50)),
+		'p95_ms': milliseconds(percentile(ordered, 0.95)),
+		'p99_ms': milliseconds(percentile(ordered, 0.99)),
+		'max_ms': milliseconds(ordered[-1] if ordered else None)
+	}
+
+###############################################################################
+
+async def get_auth_headers(client: httpx.AsyncClient, username: str, password: str):
+	'''Log in once and return the bearer header for the run'''
+	response = await client.post('/token', data={'username': username, 'password': password})
+	response.raise_for_status()
+	return {'Authorization': 'Bearer ' + response.json()['access_token']}
+
+async def login_storm(client: httpx.AsyncClient, recorder: LoadRecorder, args, headers: dict, worker: int): #pylint: disable=unused-argument
+	'''One login attempt'''
+	await recorder.request(
+		client, 'POST /token', 'POST', '/token',
+		data={'username': args.username, 'password': args.password}
+	)
+
+async def directory_browse(client: httpx.AsyncClient, recorder: LoadRecorder, args, headers: dict, worker: int): #pylint: disable=unused-argument
+	'''Page through the directory, run a search and open a few of the users listed'''
+	params = {'limit': args.page_size}
+	user_ids = []
+	for _ in range(args.pages):
+		response = await recorder.request(client, 'GET /users/', 'GET', '/users/', params=params, headers=headers)
+		if response is None or response.status_code != 200:
+			return
+		user_ids.extend(user['user_id'] for user in response.json()[:3])
+		next_cursor = response.headers.get('X-Next-Cursor')
+		if not next_cursor:
+			break
+		params = {'limit': args.page_size, 'cursor': next_cursor}
+	await recorder.request(
+		client, 'GET /users/search', 'GET', '/users/search',
+		params={'q': args.search_term}, headers=headers
+	)
+	for user_id in user_ids:
+		await recorder.request(
+			client, 'GET /users/{user_id}', 'GET', '/users/{user_id}'.format(user_id=user_id), headers=headers
+		)
+
+async def mixed_crud(client: httpx.AsyncClient, recorder: LoadRecorder, args, headers: dict, worker: int): #pylint: disable=unused-argument
+	'''Create a scratch user, then read, update, deactivate and delete it'''
+	username = 'load_{worker}_{suffix}'.format(worker=worker, suffix=uuid.uuid4().hex[:12])
+	response = await recorder.request(client, 'POST /users/', 'POST', '/users/', headers=headers, json={
+		'username': username,
+		'first_name': 'Load',
+		'last_name': 'Test',
+		'email': '{username}@test.ca'.format(username=username),
+		'password': uuid.uuid4().hex
+	})
+	if response is None or response.status_code != 200:
+		return
+	path = '/users/{user_id}'.format(user_id=response.json()['user_id'])
+	await recorder.request(client, 'GET /users/{user_id}', 'GET', path, headers=headers)
+	await recorder.request(client, 'PUT /users/{user_id}', 'PUT', path, headers=headers, json={'last_name': 'Updated'})
+	await recorder.request(
+		client, 'PUT /users/{user_id}/set_active', 'PUT', path + '/set_active',
+		params={'active': 'false'}, headers=headers
+	)
+	await recorder.request(client, 'DELETE /users/{user_id}', 'DELETE', path, headers=headers)
+
+SCENARIOS = {
+	'login_storm': login_storm,
+	'directory_browse': directory_browse,
+	'mixed_crud': mixed_crud
+}
+
+###############################################################################
+
+async def run_client(scenario, client: httpx.AsyncClient, recorder: LoadRecorder, args, headers: dict, worker: int, deadline: float): #pylint: disable=too-many-arguments
+	'''Repeat the scenario until the deadline'''
+	while time.monotonic() < deadline:
+		await scenario(client, recorder, args, headers, worker)
+
+async def run_load(args):
+	'''Run the scenario with args.concurrency clients for args.duration seconds'''
+	scenario = SCENARIOS[args.scenario]
+	limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+	async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+		headers = dict()
+		if args.scenario != 'login_storm':
+			headers = await get_auth_headers(client, args.username, args.password)
+		recorder = LoadRecorder()
+		start = time.monotonic()
+		deadline = start + args.duration
+		await asyncio.gather(*(
+			run_client(scenario, client, recorder, args, headers, worker, deadline)
+			for worker in range(args.concurrency)
+		))
+		elapsed = time.monotonic() - start
+	report = recorder.report(elapsed)
+	report.update({
+		'scenario': args.scenario,
+		'base_url': args.base_url,
+		'concurrency': args.concurrency,
+		'duration_seconds': args.duration,
+		'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - elapsed))
+	})
+	return report
+
+def main():
+	'''Main Function'''
+	parser = argparse.ArgumentParser(description='Load test the token and users endpoints of a running instance')
+	parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+	parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='directory_browse')
+	parser.add_argument('--concurrency', type=int, default=20)
+	parser.add_argument('--duration', type=float, default=30, help='seconds')
+	parser.add_argument('--timeout', type=float, default=30, help='per-request timeout in seconds')
+	parser.add_argument('--username', default=INITIAL_USER.get('username'), required='username' not in INITIAL_USER)
+	parser.add_argument('--password', default=INITIAL_USER.get('password'), required='password' not in INITIAL_USER)
+	parser.add_argument('--page-size', type=int, default=50)
+	parser.add_argument('--pages', type=int, default=3)
+	parser.add_argument('--search-term', default='user')
+	parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+	args = parser.parse_args()
+	report = asyncio.run(run_load(args))
+	text = json.dumps(report, indent=2)
+	print(text)
+	if args.output:
+		with open(args.output, 'w') as output_file:
+			output_file.write(text + '\n')
+
+###############################################################################
+
+if __name__ == '__main__':
+	main()
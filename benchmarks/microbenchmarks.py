@@ -0,0 +1,194 @@
+'''
+FastAPI Demo
+
+Benchmark - hot path microbenchmarks
+
+Times the functions every request leans on: JWT creation, the get_token decode
+(uncached and cached), password hashing and verification at several bcrypt costs,
+UserCreate validation and schemas.User ORM serialization. Needs the generated
+configuration but no database.
+Each case reports the best mean time per call over --repeat runs. --save-baseline
+records the results; later runs compare against the baseline and exit with status 1
+when any case is slower by more than --threshold. Baselines are only meaningful on
+the machine that recorded them, so benchmarks/baselines.json is not committed: record
+one on the machine you compare on before changing the code. The password cases are
+skipped when passlib cannot drive the installed bcrypt (bcrypt 4.1 and later).
+Run from the repository root:
+> python -m benchmarks.microbenchmarks --save-baseline
+> python -m benchmarks.microbenchmarks --threshold 0.2
+'''
+# Standard Imports
+import argparse
+from datetime import timedelta
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+# Local Imports
+from benchmarks.bench_user_serialization import (
+	load_rows,
+	pydantic_path
+)
+from data_schemas import schemas
+from routers import token
+from utils.token_utils import create_access_token
+import utils.user_utils as user_utils
+
+###############################################################################
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+SERIALIZATION_SIZES = (1, 100, 10000)
+USER_PAYLOAD = {
+	'username': 'bench_user',
+	'first_name': 'Bench',
+	'last_name': 'User',
+	'email': 'bench_user@test.ca',
+	'password': 'bench_password'
+}
+
+###############################################################################
+
+def run_coroutine(coroutine):
+	'''Drive a coroutine that never suspends to completion without the event loop overhead'''
+	try:
+		coroutine.send(None)
+	except StopIteration as stop:
+		return stop.value
+	coroutine.close()
+	raise RuntimeError('Benchmarked coroutine suspended; it needs an event loop')
+
+def token_cases():
+	'''JWT creation and the get_token decode, with and without the verified token cache'''
+	encoded = create_access_token(data={'user_id': 1}, expires_delta=timedelta(minutes=30))
+	if isinstance(encoded, bytes):
+		encoded = encoded.decode('utf-8')
+	def decode_uncached():
+		token.TOKEN_CACHE.clear()
+		return run_coroutine(token.get_token(encoded))
+	return {
+		'create_access_token': lambda: create_access_token(data={'user_id': 1}, expires_delta=timedelta(minutes=30)),
+		'get_token (decode)': decode_uncached,
+		'get_token (cached)': lambda: run_coroutine(token.get_token(encoded))
+	}
+
+def bcrypt_error():
+	'''The error passlib raises with the installed bcrypt, or None if hashing works'''
+	try:
+		user_utils.PWD_CONTEXT.copy(bcrypt__rounds=4).hash(USER_PAYLOAD['password'])
+	except (AttributeError, ValueError) as error:
+		return error
+	return None
+
+def password_cases(rounds_list: list):
+	'''hash_password and verify_password with user_utils.PWD_CONTEXT at each bcrypt cost'''
+	cases = dict()
+	error = bcrypt_error() if rounds_list else None
+	if error is not None:
+		print('Skipping the password cases: passlib cannot use the installed bcrypt ({error}); install bcrypt<4.1'.format(error=error))
+		return cases
+	for rounds in rounds_list:
+		context = user_utils.PWD_CONTEXT.copy(bcrypt__rounds=rounds)
+		hashed = context.hash(USER_PAYLOAD['password'] + USER_PAYLOAD['username'])
+		def with_context(function, context=context):
+			def call():
+				default_context, user_utils.PWD_CONTEXT = user_utils.PWD_CONTEXT, context
+				try:
+					return function()
+				finally:
+					user_utils.PWD_CONTEXT = default_context
+			return call
+		cases['hash_password (rounds={rounds})'.format(rounds=rounds)] = with_context(
+			lambda: user_utils.hash_password(USER_PAYLOAD['username'], USER_PAYLOAD['password'])
+		)
+		cases['verify_password (rounds={rounds})'.format(rounds=rounds)] = with_context(
+			lambda hashed=hashed: user_utils.verify_password(USER_PAYLOAD['username'], USER_PAYLOAD['password'], hashed)
+		)
+	return cases
+
+def schema_cases():
+	'''UserCreate validation, including validate_email, and User serialization from database rows'''
+	cases = {
+		'UserCreate validation': lambda: schemas.UserCreate(**USER_PAYLOAD)
+	}
+	for size in SERIALIZATION_SIZES:
+		rows = load_rows(size)
+		cases['User serialization ({size} rows)'.format(size=size)] = lambda rows=rows: pydantic_path(rows)
+	return cases
+
+def time_case(function, repeat: int):
+	'''Best mean seconds per call over repeat runs, each long enough to time reliably'''
+	timer = timeit.Timer(function)
+	number, _ = timer.autorange()
+	return min(timer.repeat(repeat=repeat, number=number)) / number
+
+###############################################################################
+
+def load_baseline(path: str):
+	'''Return the saved per-case seconds, or None if there is no baseline yet'''
+	if not os.path.exists(path):
+		return None
+	with open(path) as baseline_file:
+		return json.load(baseline_file)['results']
+
+def save_baseline(path: str, results: dict):
+	'''Record the results along with the machine they were measured on'''
+	with open(path, 'w') as baseline_file:
+		json.dump({
+			'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+			'python': platform.python_version(),
+			'machine': platform.platform(),
+			'results': results
+		}, baseline_file, indent=2, sort_keys=True)
+		baseline_file.write('\n')
+
+def main():
+	'''Main Function'''
+	parser = argparse.ArgumentParser(description='Time hot path functions and flag regressions against a baseline')
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--bcrypt-rounds', type=int, nargs='*', default=[4, 10, 12], help='costs to time the password cases at; none skips them')
+	parser.add_argument('--filter', help='only run cases whose name contains this text')
+	parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+	parser.add_argument('--save-baseline', action='store_true', help='record these results as the new baseline')
+	parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown, 0.2 = 20%%')
+	args = parser.parse_args()
+	cases = dict()
+	cases.update(token_cases())
+	cases.update(password_cases(args.bcrypt_rounds))
+	cases.update(schema_cases())
+	baseline = None if args.save_baseline else load_baseline(args.baseline)
+	results = dict()
+	regressions = []
+	for name, function in cases.items():
+		if args.filter and args.filter not in name:
+			continue
+		results[name] = time_case(function, args.repeat)
+		line = '{name:<36} {per_call:12.3f} us/call'.format(name=name, per_call=results[name] * 1e6)
+		if baseline and name in baseline:
+			change = results[name] / baseline[name] - 1
+			line += '  {change:+7.1%} vs baseline'.format(change=change)
+			if change > args.threshold:
+				regressions.append(name)
+				line += '  REGRESSION'
+		print(line)
+	if args.save_baseline:
+		previous = load_baseline(args.baseline) or dict()
+		previous.update(results)
+		save_baseline(args.baseline, previous)
+		print('Baseline saved to {path}'.format(path=args.baseline))
+	elif baseline is None:
+		print('No baseline at {path}; run with --save-baseline to record one'.format(path=args.baseline))
+	if regressions:
+		print('{count} case(s) regressed by more than {threshold:.0%}: {names}'.format(
+			count=len(regressions),
+			threshold=args.threshold,
+			names=', '.join(regressions)
+		))
+		sys.exit(1)
+
+###############################################################################
+
+if __name__ == '__main__':
+	main()
@@ -4,6 +4,7 @@ FastAPI Demo
 REST pydantic Models (not SQLAlchemy ORM Models)
 '''
 # Standard Imports
+from typing import List
 
 # PyPi Imports
 from validate_email import validate_email
@@ -51,6 +52,33 @@ class User(UserBase):
 		orm_mode = True
 
 
+class BulkUserResult(BaseModel):
+	'''Outcome of one record of a bulk user creation'''
+	index: int
+	username: str
+	status: str
+	user_id: int = None
+	detail: str = None
+
+
+class BulkSetAdmin(BaseModel):
+	'''Schema for setting the admin flag on many users'''
+	user_ids: List[int]
+	admin: bool
+
+
+class BulkSetActive(BaseModel):
+	'''Schema for setting the active flag on many users'''
+	user_ids: List[int]
+	active: bool
+
+
+class BulkFlagResult(BaseModel):
+	'''Outcome of a bulk flag change'''
+	updated: List[int]
+	missing: List[int]
+
+
 class UserUpdate(BaseModel):
 	'''Schema for updating a user'''
 	first_name: str = None
@@ -7,10 +7,12 @@ SQLAlchemy ORM Models
 
 # PyPi Imports
 from sqlalchemy import (
+	DDL,
 	Boolean,
 	Column,
 	Integer,
-	String
+	String,
+	event
 )
 
 # Local Imports
@@ -29,3 +31,26 @@ class User(Base):
 	email = Column(String, unique=True)
 	active_boolean = Column(Boolean, nullable=False, default=True)
 	admin_boolean = Column(Boolean, nullable=False, default=False)
+	row_version = Column(Integer, nullable=False, default=1, server_default='1')
+
+# Columns searched by GET /users/search, each backed by a trigram index on lower(column)
+USER_SEARCH_COLUMNS = ('username', 'first_name', 'last_name', 'email')
+
+# Hung off the metadata rather than the table so that create_all adds them to existing databases too
+event.listen(Base.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+event.listen(Base.metadata, 'after_create', DDL(
+	'ALTER TABLE users ADD COLUMN IF NOT EXISTS row_version integer NOT NULL DEFAULT 1'
+))
+for search_column in USER_SEARCH_COLUMNS:
+	event.listen(Base.metadata, 'after_create', DDL(
+		'CREATE INDEX IF NOT EXISTS ix_users_{column}_trgm ON users USING gin (lower({column}) gin_trgm_ops)'.format(
+			column=search_column
+		)
+	))
+
+
+class TokenRevocation(Base):
+	'''ORM Models - token_revocations'''
+	__tablename__ = "token_revocations"
+	user_id = Column(Integer, primary_key=True)
+	token_generation = Column(Integer, nullable=False, default=0)
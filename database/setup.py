@@ -7,28 +7,70 @@ Database setup
 
 # PyPi Imports
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import (
+	AsyncSession,
+	create_async_engine
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 # Local Imports
 from utils.config_utils import get_config
+from utils.metrics_utils import (
+	MeteredAsyncAdaptedQueuePool,
+	MeteredQueuePool,
+	PoolUsageListener
+)
 
 ###############################################################################
 CONFIG = get_config('database.cfg')
 DB_CONFIG = CONFIG['database']
-DB_URL_MASK = 'postgresql+psycopg2://{user}:{pw}@{url}/{db}'
+DB_URL_MASK = 'postgresql+{driver}://{user}:{pw}@{url}/{db}'
 DB_URL = DB_URL_MASK.format(
+    driver='psycopg2',
+    user=DB_CONFIG['POSTGRES_USER'],
+    pw=DB_CONFIG['POSTGRES_PW'],
+    url=DB_CONFIG['POSTGRES_URL'],
+    db=DB_CONFIG['POSTGRES_DB']
+)
+ASYNC_DB_URL = DB_URL_MASK.format(
+    driver=DB_CONFIG.get('ASYNC_DRIVER', 'asyncpg'),
     user=DB_CONFIG['POSTGRES_USER'],
     pw=DB_CONFIG['POSTGRES_PW'],
     url=DB_CONFIG['POSTGRES_URL'],
     db=DB_CONFIG['POSTGRES_DB']
 )
 SQLALCHEMY_DATABASE_URL = DB_URL
+SQLALCHEMY_ASYNC_DATABASE_URL = ASYNC_DB_URL
+POOL_OPTIONS = {
+	'pool_size': DB_CONFIG.getint('POOL_SIZE', 5),
+	'max_overflow': DB_CONFIG.getint('MAX_OVERFLOW', 10),
+	'pool_timeout': DB_CONFIG.getint('POOL_TIMEOUT', 30),
+	'pool_recycle': DB_CONFIG.getint('POOL_RECYCLE', -1),
+	'pool_pre_ping': DB_CONFIG.getboolean('POOL_PRE_PING', False)
+}
 
 ###############################################################################
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL) #pylint: disable=invalid-name
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=MeteredQueuePool, **POOL_OPTIONS) #pylint: disable=invalid-name
 
 session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine) #pylint: disable=invalid-name
 
+# Used by the async def routes so their queries do not block the event loop
+async_engine = create_async_engine( #pylint: disable=invalid-name
+	SQLALCHEMY_ASYNC_DATABASE_URL,
+	poolclass=MeteredAsyncAdaptedQueuePool,
+	**POOL_OPTIONS
+)
+
+POOL_USAGE = (PoolUsageListener(engine), PoolUsageListener(async_engine.sync_engine))
+
+async_session_local = sessionmaker( #pylint: disable=invalid-name
+	autocommit=False,
+	autoflush=False,
+	expire_on_commit=False,
+	class_=AsyncSession,
+	bind=async_engine
+)
+
 Base = declarative_base() #pylint: disable=invalid-name
@@ -15,9 +15,66 @@ POSTGRES_URL = 127.0.0.1:5432
 POSTGRES_DB = fastapi_demo
 POSTGRES_USER = fastapi_demo
 POSTGRES_PW = {db_secret}
+ASYNC_DRIVER = asyncpg
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_TIMEOUT = 30
+POOL_RECYCLE = 1800
+POOL_PRE_PING = true
 '''
 	return database_cfg_template.format(db_secret=os.urandom(32).hex())
 
+def generate_api_cfg():
+	'''Generate the API behaviour config file'''
+	api_cfg_template = '''[api]
+FAST_JSON_RESPONSES = false
+
+[compression]
+ENABLED = true
+MINIMUM_SIZE = 1024
+GZIP_LEVEL = 6
+; Used instead of gzip when the client accepts br and the brotli package is installed
+BROTLI_LEVEL = 4
+CONTENT_TYPES = application/json,application/x-ndjson,text/csv,text/html,text/plain
+EXCLUDED_PATHS = /token,/token/refresh
+
+[admission]
+ENABLED = true
+RETRY_AFTER_SECONDS = 1
+TOKEN_MAX_IN_FLIGHT = 16
+TOKEN_MAX_QUEUE = 64
+TOKEN_QUEUE_TIMEOUT_SECONDS = 2
+; Defaults to the database POOL_SIZE + MAX_OVERFLOW; set it only to admit fewer
+;USERS_MAX_IN_FLIGHT = 15
+USERS_MAX_QUEUE = 60
+USERS_QUEUE_TIMEOUT_SECONDS = 1
+
+[metrics]
+ENABLED = true
+PATH = /metrics
+; Scrapers must send Authorization: Bearer <TOKEN>; /metrics refuses every request while it is empty
+TOKEN = {metrics_token}
+
+[queries]
+; Count and time the SQL of every request, reporting it in the logs and a Server-Timing header
+ENABLED = true
+SERVER_TIMING = true
+; Warn when one statement runs this many times in a request, a likely N+1
+REPEATED_STATEMENT_THRESHOLD = 5
+
+[tracing]
+; Needs the opentelemetry-sdk package, plus opentelemetry-exporter-otlp-proto-http for the otlp exporter
+ENABLED = false
+SERVICE_NAME = fastapi_demo
+; Share of new traces to record; requests arriving with a traceparent follow the caller's decision
+SAMPLE_RATE = 0.1
+; file writes one JSON span per line to FILE_PATH, otlp posts to an OTLP/HTTP collector
+EXPORTER = file
+FILE_PATH = traces.jsonl
+OTLP_ENDPOINT = http://127.0.0.1:4318/v1/traces
+'''
+	return api_cfg_template.format(metrics_token=os.urandom(32).hex())
+
 def generate_initial_user_cfg():
 	'''Generate the initial user config file'''
 	initial_user_cfg_template = '''[initial_user]
@@ -36,6 +93,23 @@ SECRET_KEY = {api_secret}
 ALGORITHM = HS256
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_LEEWAY_SECONDS = 30
+HASH_EXECUTOR = thread
+HASH_WORKERS = 4
+HASH_QUEUE_DEPTH = 64
+BULK_USER_LIMIT = 1000
+AUTH_CACHE_SIZE = 1024
+AUTH_CACHE_TTL_SECONDS = 30
+TOKEN_CACHE_SIZE = 4096
+CLAIMS_AUTHORIZATION = false
+REVOCATION_REFRESH_SECONDS = 5
+LOGIN_IP_BURST = 20
+LOGIN_IP_PER_SECOND = 1
+LOGIN_USERNAME_BURST = 10
+LOGIN_USERNAME_PER_SECOND = 0.2
+LOGIN_MAX_CONCURRENT_VERIFICATIONS = 8
+LOGIN_VERIFICATION_TIMEOUT_SECONDS = 2
+; memory, or redis to share buckets between workers (needs the redis package and LOGIN_RATE_LIMIT_REDIS_URL)
+LOGIN_RATE_LIMIT_BACKEND = memory
 '''
 	return security_cfg_template.format(api_secret=os.urandom(32).hex())
 
@@ -69,10 +143,12 @@ def main():
 	config_dir = 'configuration'
 	if not os.path.exists(config_dir):
 		os.makedirs(config_dir)
+	api_config_file = os.path.join(config_dir, 'api.cfg')
 	database_config_file = os.path.join(config_dir, 'database.cfg')
 	initial_user_config_file = os.path.join(config_dir, 'initial_user.cfg')
 	security_config_file = os.path.join(config_dir, 'security.cfg')
 	testing_config_file = os.path.join(config_dir, 'testing.cfg')
+	write_config(api_config_file, generate_api_cfg())
 	write_config(database_config_file, generate_database_cfg())
 	write_config(initial_user_config_file, generate_initial_user_cfg())
 	write_config(security_config_file, generate_security_cfg())
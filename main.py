@@ -12,46 +12,102 @@ from starlette.responses import Response
 
 # Local Imports
 import database.models as models
-from database.setup import (
-	session_local,
-	engine
-)
+from database.setup import engine
 from routers import (
+	metrics,
 	token,
 	users
 )
+from utils.admission_utils import AdmissionMiddleware
+from utils.compression_utils import (
+	COMPRESSION_ENABLED,
+	CompressionMiddleware
+)
+from utils.hash_utils import HashQueueFullError
+from utils.main_utils import (
+	close_db_sessions,
+	hash_queue_full_handler
+)
+from utils.metrics_utils import (
+	METRICS_ENABLED,
+	record_request
+)
+from utils.query_utils import account_queries
+from utils.tracing_utils import (
+	trace_request,
+	traced
+)
 
 ###############################################################################
 
-models.Base.metadata.create_all(bind=engine)
-
-app = FastAPI( #pylint: disable=invalid-name
-	title="FastAPI Demo",
-    description="This is a demo application for FastAPI",
-    version="0.0.1"
-)
+def create_tables():
+	'''Create any tables that do not exist yet'''
+	models.Base.metadata.create_all(bind=engine)
 
 ###############################################################################
 
-@app.middleware("http")
+@traced()
 async def db_session_middleware(request: Request, call_next):
-	'''Function to populate requests with a database session'''
+	'''Function to give requests a lazily opened database session'''
 	response = Response("Internal server error", status_code=500)
+	request.state.db = None
+	request.state.async_db = None
 	try:
-		request.state.db = session_local()
 		response = await call_next(request)
 	finally:
-		request.state.db.close()
+		await close_db_sessions(request)
 	return response
 
+@traced()
+async def query_accounting_middleware(request: Request, call_next):
+	'''Function to count and time the SQL each request runs'''
+	return await account_queries(request, call_next)
+
+@traced()
+async def metrics_middleware(request: Request, call_next):
+	'''Function to record latency and outcome metrics for every request'''
+	return await record_request(request, call_next)
+
+async def tracing_middleware(request: Request, call_next):
+	'''Function to run each request in a trace span, continuing any incoming W3C trace'''
+	return await trace_request(request, call_next)
+
 ###############################################################################
 
-app.include_router(
-	token.router,
-	tags=["token"]
-)
-app.include_router(
-	users.router,
-	dependencies=[Depends(token.check_current_user)],
-	tags=["users"]
-)
+def create_app():
+	'''Build the application with its middleware stack and routers; the tests build theirs here too'''
+	application = FastAPI(
+		title="FastAPI Demo",
+		description="This is a demo application for FastAPI",
+		version="0.0.1"
+	)
+	application.add_event_handler("startup", create_tables)
+
+	application.middleware("http")(db_session_middleware)
+	application.middleware("http")(query_accounting_middleware)
+	application.add_middleware(AdmissionMiddleware)
+	if METRICS_ENABLED:
+		application.middleware("http")(metrics_middleware)
+	application.middleware("http")(tracing_middleware)
+	application.add_exception_handler(HashQueueFullError, hash_queue_full_handler)
+	if COMPRESSION_ENABLED:
+		application.add_middleware(CompressionMiddleware)
+
+	if METRICS_ENABLED:
+		application.include_router(
+			metrics.router,
+			dependencies=[Depends(metrics.check_metrics_token)],
+			tags=["metrics"]
+		)
+	application.include_router(
+		token.router,
+		tags=["token"]
+	)
+	application.include_router(
+		users.router,
+		dependencies=[Depends(token.check_current_user)],
+		tags=["users"]
+	)
+	return application
+
+app = create_app() #pylint: disable=invalid-name
@@ -0,0 +1,53 @@
+'''
+FastAPI Demo
+
+/metrics router
+'''
+# Standard Imports
+import hmac
+
+# PyPi Imports
+from fastapi import APIRouter, Header, HTTPException
+from starlette.responses import Response
+from starlette.status import HTTP_401_UNAUTHORIZED
+
+# Local Imports
+from utils.metrics_utils import (
+	METRICS_PATH,
+	METRICS_TOKEN,
+	render_metrics
+)
+from utils.tracing_utils import (
+	TracedAPIRoute,
+	traced
+)
+
+###############################################################################
+
+router = APIRouter(route_class=TracedAPIRoute) #pylint: disable=invalid-name
+
+###############################################################################
+
+METRICS_TOKEN_EXCEPTION = HTTPException(
+	status_code=HTTP_401_UNAUTHORIZED,
+	detail="Invalid metrics token",
+	headers={"WWW-Authenticate": "Bearer"}
+)
+
+###############################################################################
+
+@traced()
+def check_metrics_token(authorization: str = Header(None)):
+	'''Only let scrapers holding the configured [metrics] TOKEN read the metrics'''
+	scheme, _, token = (authorization or '').partition(' ')
+	if not METRICS_TOKEN or scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+		raise METRICS_TOKEN_EXCEPTION
+	return True
+
+###############################################################################
+
+@router.get(METRICS_PATH, include_in_schema=False)
+def read_metrics():
+	'''Expose runtime metrics in the Prometheus text format'''
+	content, media_type = render_metrics()
+	return Response(content=content, media_type=media_type)
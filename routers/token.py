@@ -5,25 +5,54 @@ FastAPI Demo
 '''
 # Standard Imports
 from datetime import timedelta
+import hashlib
+import math
+import time
 
 # PyPi Imports
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 import jwt
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.requests import Request
 from starlette.status import (
 	HTTP_400_BAD_REQUEST,
-	HTTP_401_UNAUTHORIZED
+	HTTP_401_UNAUTHORIZED,
+	HTTP_429_TOO_MANY_REQUESTS,
+	HTTP_503_SERVICE_UNAVAILABLE
 )
 
 # Local Imports
+from utils.cache_utils import TTLCache
 from utils.config_utils import get_config
-from utils.main_utils import get_db
+from utils.async_user_utils import (
+	authenticate_user,
+	get_token_generation,
+	get_user,
+	get_user_snapshot
+)
+from utils.main_utils import (
+	get_async_db,
+	get_async_session_factory
+)
+from utils.metrics_utils import JWT_OPERATIONS
 from utils.token_utils import create_access_token
+from utils.rate_limit_utils import (
+	LOGIN_ADMISSION,
+	LoginBusyError
+)
+from utils.tracing_utils import (
+	TracedAPIRoute,
+	start_span,
+	traced
+)
+from utils.revocation_utils import (
+	CLAIMS_AUTHORIZATION,
+	REVOCATIONS
+)
 from utils.user_utils import (
-	authenticate_user,
-	get_user
+	USER_AUTH_CACHE,
+	UserSnapshot
 )
 from data_schemas import schemas
 
@@ -34,7 +63,14 @@ SECURITY = CONFIG['security']
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token") #pylint: disable=invalid-name
 
-router = APIRouter() #pylint: disable=invalid-name
+router = APIRouter(route_class=TracedAPIRoute) #pylint: disable=invalid-name
+
+# Verified payloads keyed by token digest, each kept until its token expires
+TOKEN_CACHE = TTLCache(
+	name='token',
+	max_size=SECURITY.getint('TOKEN_CACHE_SIZE', 4096),
+	ttl=int(SECURITY['ACCESS_TOKEN_EXPIRE_MINUTES']) * 60
+)
 
 ###############################################################################
 
@@ -67,34 +103,97 @@ TOKEN_EXPIRED_EXCEPTION = HTTPException(
 	headers={"WWW-Authenticate": "Bearer"}
 )
 
+TOKEN_REVOKED_EXCEPTION = HTTPException(
+	status_code=HTTP_401_UNAUTHORIZED,
+	detail="Token Revoked. Reauthenticate",
+	headers={"WWW-Authenticate": "Bearer"}
+)
+
+LOGIN_BUSY_EXCEPTION = HTTPException(
+	status_code=HTTP_503_SERVICE_UNAVAILABLE,
+	detail="Too many logins in progress. Retry shortly",
+	headers={"Retry-After": "1"}
+)
+
 ###############################################################################
 
+@traced()
 async def get_token(token: str = Depends(oauth2_scheme)):
 	#payload: str = Depends(oauth2_scheme),
 	'''Make sure the supplied token is one of ours'''
+	token_digest = hashlib.sha256(token.encode('utf-8')).digest()
+	payload = TOKEN_CACHE.get(token_digest)
+	if payload is not None:
+		return payload
+	JWT_OPERATIONS.labels('decode').inc()
 	try:
-		payload = jwt.decode(token, SECURITY['SECRET_KEY'], algorithms=[SECURITY['ALGORITHM']])
+		with start_span('jwt.decode'):
+			payload = jwt.decode(token, SECURITY['SECRET_KEY'], algorithms=[SECURITY['ALGORITHM']])
 	except jwt.ExpiredSignatureError:
 		raise TOKEN_EXPIRED_EXCEPTION
 	except jwt.PyJWTError:
 		raise TOKEN_PROCESSING_EXCEPTION
+	expires_at = None
+	if 'exp' in payload:
+		expires_at = time.monotonic() + payload['exp'] - time.time()
+	TOKEN_CACHE.set(token_digest, payload, expires_at=expires_at)
 	return payload
 
+@traced()
 async def check_token(payload: dict = Depends(get_token)):
 	#payload: str = Depends(oauth2_scheme),
 	'''Make sure the supplied token is satisfactory'''
 	return bool(payload)
 
+async def get_claims_user(payload: dict, session_factory):
+	'''Authorize from the token claims alone, rejecting tokens revoked since they were issued'''
+	await REVOCATIONS.refresh_if_stale(session_factory)
+	if REVOCATIONS.is_revoked(payload["user_id"], payload["gen"]):
+		raise TOKEN_REVOKED_EXCEPTION
+	return UserSnapshot(
+		user_id=payload["user_id"],
+		username=payload.get("username"),
+		active_boolean=payload["active"],
+		admin_boolean=payload["admin"]
+	)
+
+async def load_user_snapshot(session_factory, user_id: int):
+	'''Load a snapshot on a session of its own, since concurrent requests share the load'''
+	database = session_factory()
+	try:
+		return await get_user_snapshot(database=database, user_id=user_id)
+	finally:
+		await database.close()
+
+async def get_token_data(user, database: AsyncSession):
+	'''Build the claims to embed in a user's access token'''
+	data = {"user_id": user.user_id}
+	if CLAIMS_AUTHORIZATION:
+		data.update({
+			"username": user.username,
+			"active": user.active_boolean,
+			"admin": user.admin_boolean,
+			"gen": await get_token_generation(database=database, user_id=user.user_id)
+		})
+	return data
+
+@traced()
 async def check_current_user(
 	request: Request,
 	payload: dict = Depends(get_token),
-	database: Session = Depends(get_db)
+	session_factory=Depends(get_async_session_factory)
 ):
 	'''Get the current user based on the included token'''
 	user_id: str = payload.get("user_id")
 	if user_id is None:
 		raise CREDENTIALS_EXCEPTION
-	user = get_user(database=database, user_id=user_id)
+	if CLAIMS_AUTHORIZATION and "gen" in payload:
+		user = await get_claims_user(payload=payload, session_factory=session_factory)
+	else:
+		user = await USER_AUTH_CACHE.get_or_load(
+			user_id,
+			lambda: load_user_snapshot(session_factory=session_factory, user_id=user_id)
+		)
 	if user is None:
 		raise CREDENTIALS_EXCEPTION
 	if not user.active_boolean:
@@ -106,32 +205,49 @@ async def check_current_user(
 
 @router.post("/token", response_model=schemas.Token)
 async def login_for_access_token(
+	request: Request,
 	form_data: OAuth2PasswordRequestForm = Depends(),
-	database: Session = Depends(get_db)
+	database: AsyncSession = Depends(get_async_db)
 ):
 	'''Issue a token if the credentials authenticate'''
-	user = authenticate_user(database=database, username=form_data.username, password=form_data.password)
+	client_ip = request.client.host if request.client else 'unknown'
+	retry_after = await LOGIN_ADMISSION.check(client_ip=client_ip, username=form_data.username)
+	if retry_after:
+		raise HTTPException(
+			status_code=HTTP_429_TOO_MANY_REQUESTS,
+			detail="Too many login attempts. Retry later",
+			headers={"Retry-After": str(math.ceil(retry_after))}
+		)
+	try:
+		async with LOGIN_ADMISSION.verification_slot():
+			user = await authenticate_user(database=database, username=form_data.username, password=form_data.password)
+	except LoginBusyError:
+		raise LOGIN_BUSY_EXCEPTION
 	if not user:
 		raise AUTHENTICATION_EXCEPTION
 	if not user.active_boolean:
 		raise INACTIVE_USER_EXCEPTION
 	access_token_expires = timedelta(minutes=int(SECURITY['ACCESS_TOKEN_EXPIRE_MINUTES']))
-	access_token = create_access_token(data={"user_id": user.user_id}, expires_delta=access_token_expires)
+	token_data = await get_token_data(user=user, database=database)
+	access_token = create_access_token(data=token_data, expires_delta=access_token_expires)
 	return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/token/refresh", response_model=schemas.Token)
 async def refresh_expired_access_token(
 	token: str = Depends(oauth2_scheme),
-	database: Session = Depends(get_db)
+	database: AsyncSession = Depends(get_async_db),
+	session_factory=Depends(get_async_session_factory)
 ):
 	'''Issue a replacement token if the current access token is not expired, or only recently expired.'''
+	JWT_OPERATIONS.labels('decode').inc()
 	try:
-		payload = jwt.decode(
-			token,
-			SECURITY['SECRET_KEY'],
-			algorithms=[SECURITY['ALGORITHM']],
-			leeway=int(SECURITY['REFRESH_TOKEN_LEEWAY_SECONDS'])
-		)
+		with start_span('jwt.decode'):
+			payload = jwt.decode(
+				token,
+				SECURITY['SECRET_KEY'],
+				algorithms=[SECURITY['ALGORITHM']],
+				leeway=int(SECURITY['REFRESH_TOKEN_LEEWAY_SECONDS'])
+			)
 	except jwt.ExpiredSignatureError:
 		raise TOKEN_EXPIRED_EXCEPTION
 	except jwt.PyJWTError:
@@ -139,11 +255,14 @@ async def refresh_expired_access_token(
 	user_id: str = payload.get("user_id")
 	if user_id is None:
 		raise CREDENTIALS_EXCEPTION
-	user = get_user(database=database, user_id=user_id)
+	if CLAIMS_AUTHORIZATION and "gen" in payload:
+		await get_claims_user(payload=payload, session_factory=session_factory)
+	user = await get_user(database=database, user_id=user_id)
 	if not user:
 		raise AUTHENTICATION_EXCEPTION
 	if not user.active_boolean:
 		raise INACTIVE_USER_EXCEPTION
 	access_token_expires = timedelta(minutes=int(SECURITY['ACCESS_TOKEN_EXPIRE_MINUTES']))
-	access_token = create_access_token(data={"user_id": user.user_id}, expires_delta=access_token_expires)
+	token_data = await get_token_data(user=user, database=database)
+	access_token = create_access_token(data=token_data, expires_delta=access_token_expires)
 	return {"access_token": access_token, "token_type": "bearer"}
@@ -7,21 +7,53 @@ FastAPI Demo
 from typing import List
 
 # PyPi Imports
-from fastapi import APIRouter, Depends, HTTPException, Path
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Query
 from sqlalchemy.orm import Session
+from starlette.requests import Request
+from starlette.responses import (
+	Response,
+	StreamingResponse
+)
 from starlette.status import (
+	HTTP_304_NOT_MODIFIED,
 	HTTP_403_FORBIDDEN,
 	HTTP_409_CONFLICT,
+	HTTP_412_PRECONDITION_FAILED,
+	HTTP_413_REQUEST_ENTITY_TOO_LARGE,
 	HTTP_422_UNPROCESSABLE_ENTITY
 )
 
 # Local Imports
 from data_schemas import schemas
-from database import models
 from utils.config_utils import get_config
+from utils.etag_utils import (
+	if_match_version,
+	if_none_match,
+	user_etag,
+	users_etag
+)
+from utils.export_utils import (
+	export_users_csv,
+	export_users_ndjson
+)
 from utils.main_utils import (
 	get_current_user,
-	get_db
+	get_db,
+	get_session_factory
+)
+from utils.pagination_utils import (
+	decode_cursor,
+	encode_cursor
+)
+from utils.response_utils import (
+	FAST_JSON_RESPONSES,
+	fast_user_response,
+	fast_users_response,
+	parse_fields
+)
+from utils.tracing_utils import (
+	TracedAPIRoute,
+	traced
 )
 import utils.user_utils as user_utils
 
@@ -30,7 +62,10 @@ import utils.user_utils as user_utils
 CONFIG = get_config('security.cfg')
 SECURITY = CONFIG['security']
 
-router = APIRouter() #pylint: disable=invalid-name
+router = APIRouter(route_class=TracedAPIRoute) #pylint: disable=invalid-name
+
+# Every record is validated, bcrypt hashed and inserted within one request
+BULK_USER_LIMIT = SECURITY.getint('BULK_USER_LIMIT', 1000)
 
 ###############################################################################
 
@@ -49,76 +84,236 @@ USERNAME_CONFLICT_EXCEPTION = HTTPException(
 	detail="Username already registered"
 )
 
+EMAIL_CONFLICT_EXCEPTION = HTTPException(
+	status_code=HTTP_409_CONFLICT,
+	detail="Email already registered"
+)
+
 NO_USER_EXCEPTION = HTTPException(
 	status_code=HTTP_422_UNPROCESSABLE_ENTITY,
 	detail="No such user_id"
 )
 
+BULK_LIMIT_EXCEPTION = HTTPException(
+	status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+	detail="Too many records in one bulk request (limit {limit})".format(limit=BULK_USER_LIMIT)
+)
+
+PRECONDITION_FAILED_EXCEPTION = HTTPException(
+	status_code=HTTP_412_PRECONDITION_FAILED,
+	detail="User has been modified since the supplied ETag"
+)
+
+INVALID_FIELDS_EXCEPTION = HTTPException(
+	status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+	detail="fields must be a comma separated list of user fields"
+)
+
+INVALID_CURSOR_EXCEPTION = HTTPException(
+	status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+	detail="Invalid pagination cursor"
+)
+
+###############################################################################
+
+@traced()
+def get_fields(fields: str = Query(None, description="Comma separated user fields to return, e.g. user_id,username")):
+	'''Dependency parsing the sparse fieldset parameter'''
+	try:
+		return parse_fields(fields)
+	except ValueError:
+		raise INVALID_FIELDS_EXCEPTION
+
+@traced()
+async def check_bulk_size(request: Request):
+	'''Dependency refusing oversized bulk requests before their records are validated into models'''
+	# FastAPI has already parsed the body to JSON, so this reads its cached copy
+	records = await request.json()
+	if isinstance(records, list) and len(records) > BULK_USER_LIMIT:
+		raise BULK_LIMIT_EXCEPTION
+
 ###############################################################################
 
 @router.post("/users/", response_model=schemas.User)
 def create_user(
 	user: schemas.UserCreate,
 	database: Session = Depends(get_db),
-	current_user: models.User = Depends(get_current_user)
+	current_user: user_utils.UserSnapshot = Depends(get_current_user)
 ):
 	'''Create a new user'''
 	if not current_user.admin_boolean:
 		raise PRIVILEGE_EXCEPTION
-	db_user = user_utils.get_user_by_username(database=database, username=user.username)
-	if db_user:
+	db_user = user_utils.create_user(database=database, user=user)
+	if db_user is None:
+		if user_utils.get_creation_conflict(database=database, user=user) == 'email':
+			raise EMAIL_CONFLICT_EXCEPTION
 		raise USERNAME_CONFLICT_EXCEPTION
-	return user_utils.create_user(database=database, user=user)
+	return db_user
+
+@router.post("/users/bulk", response_model=List[schemas.BulkUserResult], dependencies=[Depends(check_bulk_size)])
+def create_users(
+	users: List[schemas.UserCreate],
+	database: Session = Depends(get_db),
+	current_user: user_utils.UserSnapshot = Depends(get_current_user)
+):
+	'''Create many users at once, reporting the outcome of each record'''
+	if not current_user.admin_boolean:
+		raise PRIVILEGE_EXCEPTION
+	return user_utils.create_users(database=database, users=users)
+
+@router.put("/users/bulk/set_admin", response_model=schemas.BulkFlagResult)
+def change_users_admin(
+	data: schemas.BulkSetAdmin,
+	database: Session = Depends(get_db),
+	current_user: user_utils.UserSnapshot = Depends(get_current_user)
+):
+	'''Set the admin flag on many users with one statement'''
+	return change_users_flag(database, current_user, data.user_ids, admin_boolean=data.admin)
+
+@router.put("/users/bulk/set_active", response_model=schemas.BulkFlagResult)
+def change_users_active(
+	data: schemas.BulkSetActive,
+	database: Session = Depends(get_db),
+	current_user: user_utils.UserSnapshot = Depends(get_current_user)
+):
+	'''Set the active flag on many users with one statement'''
+	return change_users_flag(database, current_user, data.user_ids, active_boolean=data.active)
+
+def change_users_flag(database: Session, current_user: user_utils.UserSnapshot, user_ids: List[int], **flags):
+	'''Apply the privilege rules, then set flags on every listed user that exists'''
+	if not current_user.admin_boolean:
+		raise PRIVILEGE_EXCEPTION
+	if current_user.user_id in user_ids:
+		raise SELF_PRIVILEGE_EXCEPTION
+	if len(user_ids) > BULK_USER_LIMIT:
+		raise BULK_LIMIT_EXCEPTION
+	requested = set(user_ids)
+	updated = user_utils.set_users_flag(database=database, user_ids=requested, **flags)
+	return {'updated': sorted(updated), 'missing': sorted(requested.difference(updated))}
 
 @router.get("/users/", response_model=List[schemas.User])
 def read_users(
+	request: Request,
+	response: Response,
 	skip: int = 0,
 	limit: int = 100,
+	cursor: str = None,
+	fields: tuple = Depends(get_fields),
+	database: Session = Depends(get_db)
+):
+	'''Get a page of users ordered by user_id. Follow the Link header (or X-Next-Cursor) for the next page'''
+	after = None
+	if cursor:
+		try:
+			after = decode_cursor(cursor)
+		except ValueError:
+			raise INVALID_CURSOR_EXCEPTION
+	users = user_utils.get_users(database=database, skip=skip, limit=limit, after=after, fields=fields)
+	headers = {'ETag': users_etag(users, fields)}
+	if users and len(users) == limit:
+		next_cursor = encode_cursor(users[-1].user_id)
+		next_url = request.url.remove_query_params('skip').include_query_params(cursor=next_cursor)
+		headers['Link'] = '<{url}>; rel="next"'.format(url=next_url)
+		headers['X-Next-Cursor'] = next_cursor
+	if if_none_match(request.headers.get('if-none-match'), headers['ETag']):
+		return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+	if FAST_JSON_RESPONSES or fields:
+		return fast_users_response(users, headers=headers, fields=fields)
+	response.headers.update(headers)
+	return users
+
+@router.get("/users/search", response_model=List[schemas.User])
+def search_users(
+	query: str = Query(..., alias="q", min_length=1, max_length=100),
+	skip: int = Query(0, ge=0),
+	limit: int = Query(20, ge=1, le=100),
+	fields: tuple = Depends(get_fields),
 	database: Session = Depends(get_db)
 ):
-	'''Get a list of users'''
-	users = user_utils.get_users(database=database, skip=skip, limit=limit)
+	'''Find users whose username, name or email contains q, best matches first'''
+	users = user_utils.search_users(database=database, query=query, skip=skip, limit=limit, fields=fields)
+	if FAST_JSON_RESPONSES or fields:
+		return fast_users_response(users, fields=fields)
 	return users
 
+@router.get("/users/export")
+def export_users(
+	export_format: str = Query("ndjson", alias="format", regex="^(ndjson|csv)$"),
+	session_factory=Depends(get_session_factory)
+):
+	'''Stream every user as NDJSON or CSV'''
+	if export_format == "csv":
+		return StreamingResponse(
+			export_users_csv(session_factory),
+			media_type="text/csv",
+			headers={"Content-Disposition": 'attachment; filename="users.csv"'}
+		)
+	return StreamingResponse(export_users_ndjson(session_factory), media_type="application/x-ndjson")
+
 #item_id: int = Path(..., title="The ID of the item to get"),
 @router.get("/users/{user_id}", response_model=schemas.User)
 def read_user(
+	request: Request,
+	response: Response,
 	user_id: int = Path(..., title="The ID of the user to get"),
+	fields: tuple = Depends(get_fields),
 	database: Session = Depends(get_db)
 ):
-	'''Get a list of users'''
-	user = user_utils.get_user(database=database, user_id=user_id)
+	'''Get a user. Supports If-None-Match against the returned ETag'''
+	user = user_utils.get_user(database=database, user_id=user_id, fields=fields)
 	if not user:
 		raise NO_USER_EXCEPTION
+	etag = user_etag(user, fields)
+	if if_none_match(request.headers.get('if-none-match'), etag):
+		return Response(status_code=HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+	if FAST_JSON_RESPONSES or fields:
+		return fast_user_response(user, headers={'ETag': etag}, fields=fields)
+	response.headers['ETag'] = etag
 	return user
 
 @router.put("/users/{user_id}", response_model=schemas.User)
 def update_user(
 	user_data: schemas.UserUpdate,
+	response: Response,
 	database: Session = Depends(get_db),
 	user_id: int = Path(..., title="The ID of the user to update"),
-	current_user: models.User = Depends(get_current_user)
+	if_match: str = Header(None),
+	current_user: user_utils.UserSnapshot = Depends(get_current_user)
 ):
-	"""Updates a user"""
+	"""Updates a user. With If-Match, only if the user is still at that ETag"""
 	if not current_user.admin_boolean:
 		raise PRIVILEGE_EXCEPTION
-	if not user_utils.get_user(database=database, user_id=user_id):
+	expected_version = None
+	if if_match:
+		try:
+			expected_version = if_match_version(if_match, user_id)
+		except ValueError:
+			raise PRECONDITION_FAILED_EXCEPTION
+	db_user = user_utils.update_user(
+		database=database,
+		user_id=user_id,
+		data=user_data,
+		expected_version=expected_version
+	)
+	if db_user is None:
+		if expected_version is not None and user_utils.get_user(database=database, user_id=user_id):
+			raise PRECONDITION_FAILED_EXCEPTION
 		raise NO_USER_EXCEPTION
-	db_user = user_utils.update_user(database=database, user_id=user_id, data=user_data)
+	response.headers['ETag'] = user_etag(db_user)
 	return db_user
 
 @router.delete("/users/{user_id}", response_model=schemas.User)
 def delete_user(
 	database: Session = Depends(get_db),
 	user_id: int = Path(..., title="The ID of the user to update"),
-	current_user: models.User = Depends(get_current_user)
+	current_user: user_utils.UserSnapshot = Depends(get_current_user)
 ):
 	"""Deletes a user"""
 	if current_user.user_id != user_id and not current_user.admin_boolean:
 		raise PRIVILEGE_EXCEPTION
-	if not user_utils.get_user(database=database, user_id=user_id):
-		raise NO_USER_EXCEPTION
 	result = user_utils.delete_user(database=database, user_id=user_id)
+	if result is None:
+		raise NO_USER_EXCEPTION
 	return result
 
 @router.put("/users/{user_id}/set_password")
@@ -126,14 +321,13 @@ def change_user_password(
 	password: str,
 	user_id: int = Path(..., title="The ID of the user to update"),
 	database: Session = Depends(get_db),
-	current_user: models.User = Depends(get_current_user)
+	current_user: user_utils.UserSnapshot = Depends(get_current_user)
 ):
 	"""Sets a password"""
 	if current_user.user_id != user_id and not current_user.admin_boolean:
 		raise PRIVILEGE_EXCEPTION
-	if not user_utils.get_user(database=database, user_id=user_id):
+	if not user_utils.set_password(database=database, user_id=user_id, password=password):
 		raise NO_USER_EXCEPTION
-	user_utils.set_password(database=database, user_id=user_id, password=password)
 	return {'message': 'Password successfully changed'}
 
 @router.put("/users/{user_id}/set_admin")
@@ -141,16 +335,15 @@ def change_user_admin(
 	admin: bool,
 	user_id: int = Path(..., title="The ID of the user to update"),
 	database: Session = Depends(get_db),
-	current_user: models.User = Depends(get_current_user)
+	current_user: user_utils.UserSnapshot = Depends(get_current_user)
 ):
 	"""Set the admin flag on a user"""
 	if not current_user.admin_boolean:
 		raise PRIVILEGE_EXCEPTION
 	if current_user.user_id == user_id:
 		raise SELF_PRIVILEGE_EXCEPTION
-	if not user_utils.get_user(database=database, user_id=user_id):
+	if not user_utils.set_user_admin(database=database, user_id=user_id, admin=admin):
 		raise NO_USER_EXCEPTION
-	user_utils.set_user_admin(database=database, user_id=user_id, admin=admin)
 	return {'message': 'Admin flag successfully changed'}
 
 @router.put("/users/{user_id}/set_active")
@@ -158,14 +351,13 @@ def change_user_active(
 	active: bool,
 	user_id: int = Path(..., title="The ID of the user to update"),
 	database: Session = Depends(get_db),
-	current_user: models.User = Depends(get_current_user)
+	current_user: user_utils.UserSnapshot = Depends(get_current_user)
 ):
 	"""Set the admin flag on a user"""
 	if not current_user.admin_boolean:
 		raise PRIVILEGE_EXCEPTION
 	if current_user.user_id == user_id:
 		raise SELF_PRIVILEGE_EXCEPTION
-	if not user_utils.get_user(database=database, user_id=user_id):
+	if not user_utils.set_user_active(database=database, user_id=user_id, active=active):
 		raise NO_USER_EXCEPTION
-	user_utils.set_user_active(database=database, user_id=user_id, active=active)
 	return {'message': 'Active flag successfully changed'}
@@ -2,20 +2,53 @@
 Test the database functionality for SREDPrep
 
 Test Check Functions
+
+Pass --workers N to split the test modules across N processes. Each process builds
+its fixtures in its own schema (see testing/fixtures.py), so they do not collide.
 '''
 # Standard Imports
+import argparse
+import os
+import subprocess
+import sys
 import unittest
 
 # PyPi Imports
 
 # Local Imports
-from testing.test_token_endpoint import TestTokenEndpoint #pylint: disable=unused-import
-from testing.test_users_endpoint import TestUsersEndpoint #pylint: disable=unused-import
 
 ###############################################################################
 
+TEST_MODULES = [
+	'testing.test_admission_middleware',
+	'testing.test_compression_middleware',
+	'testing.test_metrics_endpoint',
+	'testing.test_token_endpoint',
+	'testing.test_tracing',
+	'testing.test_users_endpoint'
+]
+
+###############################################################################
+
+def run_parallel(workers: int):
+	'''Run the test modules across worker processes, returning the worst exit status'''
+	processes = []
+	for worker in range(workers):
+		modules = TEST_MODULES[worker::workers]
+		if modules:
+			processes.append(subprocess.Popen(
+				[sys.executable, '-m', 'unittest'] + modules,
+				env=dict(os.environ, TEST_WORKER_ID=str(worker))
+			))
+	return max(process.wait() for process in processes)
+
 #######################################
 # Bare main unit test function
 #######################################
 if __name__ == '__main__':
-	unittest.main()
+	PARSER = argparse.ArgumentParser(description='Run the test suite')
+	PARSER.add_argument('--workers', type=int, default=1)
+	ARGS, UNITTEST_ARGS = PARSER.parse_known_args()
+	if ARGS.workers > 1:
+		sys.exit(run_parallel(ARGS.workers))
+	unittest.main(module=None, argv=[sys.argv[0]] + UNITTEST_ARGS + TEST_MODULES)
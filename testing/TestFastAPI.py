@@ -4,26 +4,38 @@ Test FastAPI Demo
 Common Classes
 '''
 # Standard Imports
-from datetime import timedelta
+import functools
 import re
 import unittest
 import urllib
 
 # PyPi Imports
-from fastapi import Depends, FastAPI
-from starlette.requests import Request
-from starlette.responses import Response
 from starlette.testclient import TestClient
 
 # Local Imports
-from database.setup import session_local
-from data_schemas import schemas
-from routers import (
-	token,
-	users
+from database.setup import (
+	async_engine,
+	engine
+)
+from main import create_app
+from testing.fixtures import (
+	AsyncSessionAdapter,
+	bind_async_test_session,
+	bind_test_session,
+	clear_process_state,
+	close_async_test_connection,
+	create_test_user,
+	get_authentication_token,
+	get_session_fixtures,
+	open_async_test_connection
 )
 from utils.config_utils import get_config
-from utils.token_utils import create_access_token
+from utils.main_utils import (
+	get_async_db,
+	get_async_session_factory,
+	get_db,
+	get_session_factory
+)
 import utils.user_utils as user_utils
 
 ###############################################################################
@@ -37,81 +49,71 @@ PASS_MSG = 'Parameters meant to pass the test produced negative result'
 ###############################################################################
 class TestFastAPI(unittest.TestCase):
 	'''Template class for testing a PostgreSQL database'''
-	def __init__(self, *args, **kwargs):
-		super(TestFastAPI, self).__init__(*args, **kwargs)
-		self.app = FastAPI()
-		self.setup_fastapi_app()
-		self.client = TestClient(self.app)
-		self.session = session_local()
-		self.admin_user = self.get_test_user(TESTING['admin_user'], TESTING['admin_user_password'])
-		user_utils.set_user_admin(database=self.session, user_id=self.admin_user.user_id, admin=True)
-		self.admin_token = self.get_authentication_token(TESTING['admin_user'], 30)
-		self.regular_user = self.get_test_user(TESTING['regular_user'], TESTING['regular_user_password'])
-		self.regular_token = self.get_authentication_token(TESTING['regular_user'], 30)
-		self.inactive_user = self.get_test_user(TESTING['inactive_user'], TESTING['inactive_user_password'])
-		user_utils.set_user_active(database=self.session, user_id=self.inactive_user.user_id, active=False)
-		self.inactive_token = self.get_authentication_token(TESTING['inactive_user'], 30)
-		self.expired_token = self.get_authentication_token(TESTING['regular_user'], -30)
+	# True runs the async routes on a real AsyncSession over asyncpg. It has its own
+	# connection, so those routes only see committed data such as the shared users;
+	# False hands them the test's sync session so they see what the test wrote.
+	use_async_engine = False
 
-	def __del__(self):
-		self.session.close()
+	@classmethod
+	def setUpClass(cls):
+		'''Build the application once per class and share the process-wide fixtures'''
+		fixtures = get_session_fixtures()
+		cls.admin_user = fixtures.admin_user
+		cls.admin_token = fixtures.admin_token
+		cls.regular_user = fixtures.regular_user
+		cls.regular_token = fixtures.regular_token
+		cls.inactive_user = fixtures.inactive_user
+		cls.inactive_token = fixtures.inactive_token
+		cls.expired_token = fixtures.expired_token
+		cls.app = create_app()
+		# Keep one event loop for the whole class, since asyncpg connections belong to the loop that opened them
+		cls.client = TestClient(cls.app)
+		cls.client.__enter__() #pylint: disable=unnecessary-dunder-call
 
-	def setup_fastapi_app(self):
-		'''Setup the FastAPI application'''
-		@self.app.middleware("http")
-		async def db_session_middleware(request: Request, call_next): #pylint: disable=unused-variable
-			'''Function to populate requests with a database session'''
-			response = Response("Internal server error", status_code=500)
-			try:
-				request.state.db = session_local()
-				response = await call_next(request)
-			finally:
-				request.state.db.close()
-			return response
-		self.app.include_router(
-			token.router,
-			tags=["token"]
-		)
-		self.app.include_router(
-			users.router,
-			dependencies=[Depends(token.check_current_user)],
-			tags=["users"]
-		)
+	@classmethod
+	def tearDownClass(cls):
+		'''Close the async pool's connections on their loop before the loop goes away'''
+		cls.client.portal.call(async_engine.dispose)
+		cls.client.__exit__(None, None, None)
 
-	def remove_test_usernames(self):
-		'''Clean up users created during user_creation tests'''
-		untaken_usernames = ['admin_user', 'regular_user', 'inactive_user']
-		for untaken_username in untaken_usernames:
-			user = user_utils.get_user_by_username(self.session, untaken_username)
-			if user:
-				user_utils.delete_user(self.session, user.user_id)
+	def setUp(self):
+		'''Run the test inside a transaction that tearDown rolls back'''
+		clear_process_state()
+		self.connection = engine.connect()
+		self.transaction = self.connection.begin()
+		self.session = bind_test_session(self.connection)
+		self.app.dependency_overrides[get_db] = lambda: self.session
+		self.app.dependency_overrides[get_session_factory] = lambda: functools.partial(bind_test_session, self.connection)
+		if self.use_async_engine:
+			self.async_connection, self.async_transaction = self.client.portal.call(open_async_test_connection)
+			self.async_session = bind_async_test_session(self.async_connection)
+			self.app.dependency_overrides[get_async_db] = lambda: self.async_session
+			self.app.dependency_overrides[get_async_session_factory] = lambda: functools.partial(bind_async_test_session, self.async_connection)
+		else:
+			self.app.dependency_overrides[get_async_db] = lambda: AsyncSessionAdapter(self.session)
+			self.app.dependency_overrides[get_async_session_factory] = lambda: functools.partial(AsyncSessionAdapter, self.session)
+
+	def tearDown(self):
+		'''Throw away everything the test wrote'''
+		self.app.dependency_overrides.clear()
+		if self.use_async_engine:
+			self.client.portal.call(close_async_test_connection, self.async_session, self.async_connection, self.async_transaction)
+		self.session.close()
+		self.transaction.rollback()
+		self.connection.close()
+		clear_process_state()
 
 	def get_test_user(self, username: str, password: str):
-		'''Get or create a user for testing purposes'''
+		'''Get or create a user for testing purposes; users created here vanish with the test's transaction'''
 		user = user_utils.get_user_by_username(self.session, username=username)
 		if not user:
-			user_data = schemas.UserCreate(
-				username=username,
-				first_name='Test',
-				last_name='User',
-				email='{username}@test.ca'.format(username=username),
-				password=password
-			)
-			return user_utils.create_user(database=self.session, user=user_data)
-		else:
-			return user
+			return create_test_user(self.session, username, password)
+		return user
 
 	def get_authentication_token(self, username: str, expires_in: int):
 		'''Get an authorized access token for testing'''
 		user = user_utils.get_user_by_username(self.session, username)
-		token_str = create_access_token(
-			data={"user_id": user.user_id},
-			expires_delta=timedelta(minutes=expires_in)
-		)
-		token_dict = {
-			"Authorization": 'Bearer ' + token_str.decode('utf-8')
-		}
-		return token_dict
+		return get_authentication_token(user.user_id, expires_in)
 
 	###########################################################################
 	# Test templates
@@ -124,6 +126,7 @@ class TestFastAPI(unittest.TestCase):
 		http_method: str = 'get',
 		expected_status: int = 200,
 		expected_data: dict = None,
+		expected_headers: dict = None,
 		header_params: dict = None,
 		path_params: dict = None,
 		query_params: dict = None,
@@ -164,13 +167,16 @@ class TestFastAPI(unittest.TestCase):
 			description=description,
 			status=str(response.status_code),
 			expected_status=str(expected_status),
-			error=str(response.json())
+			error=response.text
 		)
 		self.assertTrue(response.status_code == expected_status, msg=bad_status_message)
 		if expected_data:
 			response_dict = response.json()
 			for key in expected_data:
 				self.assertTrue(re.match(expected_data[key], response_dict[key]), msg=message)
+		if expected_headers:
+			for key in expected_headers:
+				self.assertTrue(re.match(expected_headers[key], response.headers.get(key, '')), msg=message)
 
 	def template_test_endpoint_cases(self, test_dict: dict):
 		'''Unit Test template to test all the different possible endpoint HTTP statuses'''
@@ -181,6 +187,7 @@ class TestFastAPI(unittest.TestCase):
 				description=test_case['test_case_description'],
 				expected_status=test_case['http_status'],
 				expected_data=test_case.get('expected_data', None),
+				expected_headers=test_case.get('expected_headers', None),
 				header_params=test_case.get('header_params', None),
 				path_params=test_case.get('path_params', None),
 				query_params=test_case.get('query_params', None),
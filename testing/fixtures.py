@@ -0,0 +1,179 @@
+'''
+Test FastAPI Demo
+
+Session fixtures and per-test transactions
+'''
+# Standard Imports
+from datetime import timedelta
+import functools
+import os
+import re
+from typing import NamedTuple
+
+# PyPi Imports
+import sqlalchemy
+from sqlalchemy import (
+	event,
+	text
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+# Local Imports
+from database import models
+from database.setup import (
+	async_engine,
+	engine,
+	session_local
+)
+from data_schemas import schemas
+from routers.token import TOKEN_CACHE
+from utils.config_utils import get_config
+from utils.rate_limit_utils import LOGIN_ADMISSION
+from utils.revocation_utils import REVOCATIONS
+from utils.token_utils import create_access_token
+import utils.user_utils as user_utils
+
+###############################################################################
+
+CONFIG = get_config('testing.cfg')
+TESTING = CONFIG['testing']
+
+# Each parallel worker gets its own schema: run_tests.py sets TEST_WORKER_ID, pytest-xdist sets PYTEST_XDIST_WORKER
+TEST_WORKER = os.environ.get('TEST_WORKER_ID') or os.environ.get('PYTEST_XDIST_WORKER') or 'main'
+TEST_SCHEMA = 'test_' + re.sub(r'\W', '_', TEST_WORKER)
+
+SQLALCHEMY_2 = int(sqlalchemy.__version__.split('.')[0]) >= 2
+
+###############################################################################
+
+class SessionFixtures(NamedTuple):
+	'''Users and tokens created once per test process and shared by every test'''
+	admin_user: tuple
+	regular_user: tuple
+	inactive_user: tuple
+	admin_token: dict
+	regular_token: dict
+	inactive_token: dict
+	expired_token: dict
+
+
+class AsyncSessionAdapter:
+	'''Lets the async routes use the test's sync session, so they see its uncommitted data'''
+	def __init__(self, session: Session):
+		self.session = session
+
+	async def execute(self, *args, **kwargs):
+		'''Run a statement on the wrapped session'''
+		return self.session.execute(*args, **kwargs)
+
+	async def commit(self):
+		'''Release the wrapped session's savepoint'''
+		self.session.commit()
+
+	async def rollback(self):
+		'''Roll back to the wrapped session's savepoint'''
+		self.session.rollback()
+
+	async def close(self):
+		'''Leave the session open; the test owns it'''
+
+###############################################################################
+
+def _set_search_path(dbapi_connection, connection_record): #pylint: disable=unused-argument
+	'''Point every new connection at the worker's schema, with public still visible for pg_trgm'''
+	cursor = dbapi_connection.cursor()
+	cursor.execute('SET search_path TO {schema}, public'.format(schema=TEST_SCHEMA))
+	cursor.close()
+	dbapi_connection.commit()
+
+def bind_test_session(connection):
+	'''Open a session on the test connection whose commits and rollbacks only touch savepoints'''
+	if SQLALCHEMY_2:
+		return Session(bind=connection, autoflush=False, join_transaction_mode='create_savepoint')
+	session = Session(bind=connection, autoflush=False)
+	session.begin_nested()
+	@event.listens_for(session, 'after_transaction_end')
+	def restart_savepoint(session, transaction): #pylint: disable=unused-variable
+		'''Reopen the savepoint whenever the code under test commits or rolls back'''
+		if transaction.nested and not transaction._parent.nested: #pylint: disable=protected-access
+			session.begin_nested()
+	return session
+
+def bind_async_test_session(connection):
+	'''Open an AsyncSession on the test's async connection whose commits and rollbacks only touch savepoints'''
+	return AsyncSession(bind=connection, autoflush=False, expire_on_commit=False, join_transaction_mode='create_savepoint')
+
+async def open_async_test_connection():
+	'''Open an asyncpg connection on the worker's schema, inside a transaction the test rolls back'''
+	connection = await async_engine.connect()
+	transaction = await connection.begin()
+	return connection, transaction
+
+async def close_async_test_connection(session: AsyncSession, connection, transaction):
+	'''Throw away everything the test wrote through its async connection'''
+	await session.close()
+	await transaction.rollback()
+	await connection.close()
+
+def get_authentication_token(user_id: int, expires_in: int):
+	'''Get an authorized access token for testing'''
+	token_str = create_access_token(
+		data={"user_id": user_id},
+		expires_delta=timedelta(minutes=expires_in)
+	)
+	if isinstance(token_str, bytes):
+		token_str = token_str.decode('utf-8')
+	return {"Authorization": 'Bearer ' + token_str}
+
+def create_test_user(session: Session, username: str, password: str):
+	'''Create a user for testing purposes'''
+	return user_utils.create_user(database=session, user=schemas.UserCreate(
+		username=username,
+		first_name='Test',
+		last_name='User',
+		email='{username}@test.ca'.format(username=username),
+		password=password
+	))
+
+def create_test_schema():
+	'''Recreate the worker's schema and its tables'''
+	for worker_engine in (engine, async_engine.sync_engine):
+		event.listen(worker_engine, 'connect', _set_search_path)
+	engine.dispose()
+	with engine.begin() as connection:
+		connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public'))
+		connection.execute(text('DROP SCHEMA IF EXISTS {schema} CASCADE'.format(schema=TEST_SCHEMA)))
+		connection.execute(text('CREATE SCHEMA {schema}'.format(schema=TEST_SCHEMA)))
+	with engine.begin() as connection:
+		models.Base.metadata.create_all(bind=connection.execution_options(schema_translate_map={None: TEST_SCHEMA}))
+
+@functools.lru_cache(maxsize=None)
+def get_session_fixtures():
+	'''Build the worker's schema and shared users the first time a test asks for them'''
+	create_test_schema()
+	session = session_local()
+	try:
+		admin_user = create_test_user(session, TESTING['admin_user'], TESTING['admin_user_password'])
+		admin_user = user_utils.set_user_admin(database=session, user_id=admin_user.user_id, admin=True)
+		regular_user = create_test_user(session, TESTING['regular_user'], TESTING['regular_user_password'])
+		inactive_user = create_test_user(session, TESTING['inactive_user'], TESTING['inactive_user_password'])
+		inactive_user = user_utils.set_user_active(database=session, user_id=inactive_user.user_id, active=False)
+	finally:
+		session.close()
+	return SessionFixtures(
+		admin_user=admin_user,
+		regular_user=regular_user,
+		inactive_user=inactive_user,
+		admin_token=get_authentication_token(admin_user.user_id, 30),
+		regular_token=get_authentication_token(regular_user.user_id, 30),
+		inactive_token=get_authentication_token(inactive_user.user_id, 30),
+		expired_token=get_authentication_token(regular_user.user_id, -30)
+	)
+
+def clear_process_state():
+	'''Forget everything cached in this process so no test sees another's rolled back data'''
+	user_utils.USER_AUTH_CACHE.clear()
+	TOKEN_CACHE.clear()
+	REVOCATIONS.clear()
+	LOGIN_ADMISSION.backend.clear()
@@ -0,0 +1,139 @@
+'''
+Test FastAPI Demo
+
+Per route group admission control
+'''
+# Standard Imports
+import asyncio
+import unittest
+from unittest import mock
+
+# PyPi Imports
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+# Local Imports
+from utils.admission_utils import (
+	ADMISSION_GATES,
+	AdmissionGate,
+	AdmissionMiddleware,
+	AdmissionRejectedError
+)
+
+###############################################################################
+
+def users_endpoint(request): #pylint: disable=unused-argument
+	'''A route inside the /users group'''
+	return PlainTextResponse('ok')
+
+APP = Starlette(routes=[Route('/users/', users_endpoint)])
+APP.add_middleware(AdmissionMiddleware, enabled=True, retry_after=3)
+
+###############################################################################
+
+async def settle():
+	'''Let every ready task run until it blocks again'''
+	for _ in range(5):
+		await asyncio.sleep(0)
+
+##############################################################################
+# Testing class
+##############################################################################
+class TestAdmissionMiddleware(unittest.TestCase):
+	'''Test Validator Functions'''
+	def __init__(self, *args, **kwargs): #pylint: disable=W0235
+		super(TestAdmissionMiddleware, self).__init__(*args, **kwargs)
+
+	def test_fifo_handoff(self):
+		'''Test that released slots go to the waiters in arrival order'''
+		async def scenario():
+			gate = AdmissionGate('users', max_in_flight=1, max_queue=3, queue_timeout=5)
+			admitted = []
+			async def waiter(name):
+				await gate.acquire()
+				admitted.append(name)
+			await gate.acquire()
+			tasks = [asyncio.ensure_future(waiter(name)) for name in ('first', 'second', 'third')]
+			await settle()
+			self.assertEqual(gate.stats()['queued'], 3)
+			for _ in tasks:
+				gate.release()
+				await settle()
+			await asyncio.gather(*tasks)
+			self.assertEqual(admitted, ['first', 'second', 'third'])
+			self.assertEqual(gate.stats(), {'in_flight': 1, 'queued': 0, 'rejected': 0, 'timed_out': 0})
+			gate.release()
+			self.assertEqual(gate.in_flight, 0)
+		asyncio.run(scenario())
+
+	def test_queue_full(self):
+		'''Test that arrivals beyond the queue bound are rejected at once'''
+		async def scenario():
+			gate = AdmissionGate('users', max_in_flight=1, max_queue=1, queue_timeout=5)
+			await gate.acquire()
+			queued = asyncio.ensure_future(gate.acquire())
+			await settle()
+			with self.assertRaises(AdmissionRejectedError) as context:
+				await gate.acquire()
+			self.assertEqual(context.exception.reason, 'queue full')
+			self.assertEqual(gate.rejected, 1)
+			gate.release()
+			await queued
+			gate.release()
+			self.assertEqual(gate.in_flight, 0)
+		asyncio.run(scenario())
+
+	def test_queue_timeout(self):
+		'''Test that a waiter gives up after queue_timeout and leaves the queue'''
+		async def scenario():
+			gate = AdmissionGate('users', max_in_flight=1, max_queue=1, queue_timeout=0.01)
+			await gate.acquire()
+			with self.assertRaises(AdmissionRejectedError) as context:
+				await gate.acquire()
+			self.assertEqual(context.exception.reason, 'queue timeout')
+			self.assertEqual(gate.stats(), {'in_flight': 1, 'queued': 0, 'rejected': 0, 'timed_out': 1})
+			gate.release()
+			self.assertEqual(gate.in_flight, 0)
+		asyncio.run(scenario())
+
+	def test_abandoned_waiter(self):
+		'''Test that a slot handed to a waiter cancelled in the meantime is not lost'''
+		async def scenario():
+			gate = AdmissionGate('users', max_in_flight=1, max_queue=2, queue_timeout=5)
+			await gate.acquire()
+			abandoned = asyncio.ensure_future(gate.acquire())
+			following = asyncio.ensure_future(gate.acquire())
+			await settle()
+			gate.release()
+			abandoned.cancel()
+			await settle()
+			# The slot either reached the abandoned waiter's caller or was passed on, never both or neither
+			holders = [task for task in (abandoned, following) if task.done() and not task.cancelled()]
+			self.assertEqual(len(holders), 1)
+			self.assertEqual(gate.in_flight, 1)
+			if holders[0] is abandoned:
+				gate.release()
+				await settle()
+			self.assertTrue(following.done())
+			gate.release()
+			self.assertEqual(gate.stats(), {'in_flight': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0})
+		asyncio.run(scenario())
+
+	def test_shed_with_retry_after(self):
+		'''Test that the middleware answers a full route group with 503 and Retry-After'''
+		client = TestClient(APP)
+		with mock.patch.dict(ADMISSION_GATES, {'/users': AdmissionGate('users', 1, 0, 1)}):
+			self.assertEqual(client.get('/users/').status_code, 200)
+			self.assertEqual(ADMISSION_GATES['/users'].in_flight, 0, msg='Slot not released after the response')
+			ADMISSION_GATES['/users'].in_flight = 1
+			response = client.get('/users/')
+		self.assertEqual(response.status_code, 503)
+		self.assertEqual(response.headers.get('Retry-After'), '3')
+
+#######################################
+# Bare main unit test function
+#######################################
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,129 @@
+'''
+Test FastAPI Demo
+
+Response compression middleware
+'''
+# Standard Imports
+import gzip
+import unittest
+
+# PyPi Imports
+from starlette.applications import Starlette
+from starlette.responses import (
+	JSONResponse,
+	Response,
+	StreamingResponse
+)
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+# Local Imports
+from utils.compression_utils import (
+	CompressionMiddleware,
+	brotli,
+	choose_encoding
+)
+
+###############################################################################
+
+PAYLOAD = [{'user_id': user_id, 'username': 'user{user_id}'.format(user_id=user_id)} for user_id in range(100)]
+NDJSON_LINES = ['{{"user_id":{user_id}}}\n'.format(user_id=user_id) for user_id in range(100)]
+
+###############################################################################
+
+def json_endpoint(request): #pylint: disable=unused-argument
+	'''A large JSON body carrying a strong ETag'''
+	return JSONResponse(PAYLOAD, headers={'ETag': '"l1234"'})
+
+def small_endpoint(request): #pylint: disable=unused-argument
+	'''A JSON body under the minimum size'''
+	return JSONResponse({'user_id': 1})
+
+def binary_endpoint(request): #pylint: disable=unused-argument
+	'''A large body of a content type that is not allowlisted'''
+	return Response(b'\x89PNG' + bytes(4096), media_type='image/png')
+
+def encoded_endpoint(request): #pylint: disable=unused-argument
+	'''A large body the application already encoded'''
+	return Response(gzip.compress(bytes(4096)), media_type='application/json', headers={'Content-Encoding': 'gzip'})
+
+def stream_endpoint(request): #pylint: disable=unused-argument
+	'''A streamed NDJSON body'''
+	async def lines():
+		for line in NDJSON_LINES:
+			yield line.encode('utf-8')
+	return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+APP = Starlette(routes=[
+	Route('/json', json_endpoint),
+	Route('/small', small_endpoint),
+	Route('/binary', binary_endpoint),
+	Route('/encoded', encoded_endpoint),
+	Route('/stream', stream_endpoint),
+	Route('/token', json_endpoint, methods=['GET', 'POST'])
+])
+APP.add_middleware(CompressionMiddleware, minimum_size=500, excluded_paths=('/token',))
+
+##############################################################################
+# Testing class
+##############################################################################
+class TestCompressionMiddleware(unittest.TestCase):
+	'''Test Validator Functions'''
+	def __init__(self, *args, **kwargs): #pylint: disable=W0235
+		super(TestCompressionMiddleware, self).__init__(*args, **kwargs)
+		self.client = TestClient(APP)
+
+	def get(self, path: str, accept_encoding: str = 'gzip'):
+		'''Request a path with the given Accept-Encoding'''
+		return self.client.get(path, headers={'Accept-Encoding': accept_encoding})
+
+	def test_choose_encoding(self):
+		'''Test Accept-Encoding negotiation'''
+		self.assertEqual(choose_encoding('gzip, deflate'), 'gzip')
+		self.assertEqual(choose_encoding('*'), 'gzip')
+		self.assertIsNone(choose_encoding('identity'))
+		self.assertIsNone(choose_encoding('gzip;q=0'))
+		self.assertIsNone(choose_encoding(''))
+		self.assertEqual(choose_encoding('br;q=0, gzip'), 'gzip')
+		self.assertEqual(choose_encoding('br, gzip'), 'br' if brotli is not None else 'gzip')
+
+	def test_compressed_response(self):
+		'''Test that large allowlisted bodies are gzipped with Vary and a weakened ETag'''
+		response = self.get('/json')
+		self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+		self.assertIn('Accept-Encoding', response.headers.get('Vary', ''))
+		self.assertEqual(response.headers.get('ETag'), 'W/"l1234"')
+		self.assertLess(int(response.headers['Content-Length']), len(JSONResponse(PAYLOAD).body))
+		self.assertEqual(response.json(), PAYLOAD)
+
+	def test_uncompressed_responses(self):
+		'''Test that compression is skipped where it must not or need not apply'''
+		cases = [
+			('/json', 'identity', 'client does not accept gzip'),
+			('/json', 'gzip;q=0', 'client refuses gzip'),
+			('/small', 'gzip', 'body under the minimum size'),
+			('/binary', 'gzip', 'content type not allowlisted'),
+			('/token', 'gzip', 'excluded path')
+		]
+		for path, accept_encoding, description in cases:
+			response = self.get(path, accept_encoding)
+			self.assertNotIn('Content-Encoding', response.headers, msg=description)
+			self.assertNotIn('Vary', response.headers, msg=description)
+		self.assertEqual(self.get('/token').headers.get('ETag'), '"l1234"', msg='ETag changed on an uncompressed body')
+		response = self.get('/encoded')
+		self.assertEqual(response.headers.get('Content-Encoding'), 'gzip', msg='Encoded body was re-encoded')
+		self.assertEqual(response.content, bytes(4096))
+
+	def test_streamed_response(self):
+		'''Test that streamed bodies are compressed chunk by chunk'''
+		response = self.get('/stream')
+		self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+		self.assertIn('Accept-Encoding', response.headers.get('Vary', ''))
+		self.assertNotIn('Content-Length', response.headers)
+		self.assertEqual(response.text, ''.join(NDJSON_LINES))
+
+#######################################
+# Bare main unit test function
+#######################################
+if __name__ == '__main__':
+	unittest.main()
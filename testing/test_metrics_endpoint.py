@@ -0,0 +1,89 @@
+'''
+Test FastAPI Demo
+
+/metrics
+'''
+# Standard Imports
+import unittest
+
+# PyPi Imports
+from prometheus_client import REGISTRY
+
+# Local Imports
+from testing.TestFastAPI import TestFastAPI
+from utils.metrics_utils import METRICS_TOKEN
+
+###############################################################################
+
+METRICS_HEADERS = {"Authorization": "Bearer " + METRICS_TOKEN}
+
+##############################################################################
+# Testing class
+##############################################################################
+class TestMetricsEndpoint(TestFastAPI):
+	'''Test Validator Functions'''
+	def __init__(self, *args, **kwargs): #pylint: disable=W0235
+		super(TestMetricsEndpoint, self).__init__(*args, **kwargs)
+
+	def test_metrics_endpoint(self):
+		'''Test if REST API /metrics endpoint functions correctly'''
+		test_dict = {
+			'http_method': 'get',
+			'path': '/metrics',
+			'test_cases': [
+				{
+					'test_case_description': 'metrics_exposed',
+					'http_status': 200,
+					'header_params': METRICS_HEADERS,
+					'message': 'Metrics not exposed'
+				},
+				{
+					'test_case_description': 'missing_token',
+					'http_status': 401,
+					'expected_data': {
+						'detail': r'^Invalid metrics token$'
+					},
+					'message': 'Metrics exposed without a token'
+				},
+				{
+					'test_case_description': 'wrong_token',
+					'http_status': 401,
+					'header_params': {"Authorization": "Bearer " + METRICS_TOKEN[::-1] + "x"},
+					'message': 'Metrics exposed for a wrong token'
+				},
+				{
+					'test_case_description': 'user_token',
+					'http_status': 401,
+					'header_params': self.admin_token,
+					'message': 'Metrics exposed for a user access token'
+				}
+			]
+		}
+		self.template_test_endpoint_cases(test_dict=test_dict)
+
+	def test_request_metrics(self):
+		'''Test that requests are recorded against their route template'''
+		self.client.get('/users/{user_id}'.format(user_id=self.regular_user.user_id), headers=self.admin_token)
+		response = self.client.get('/metrics', headers=METRICS_HEADERS)
+		self.assertIn('http_requests_total{method="GET",route="/users/{user_id}",status="200"}', response.text)
+		self.assertIn('password_hash_duration_seconds', response.text)
+		self.assertIn('db_pool_checked_out_connections', response.text)
+
+	def test_cache_metrics(self):
+		'''Test that a repeated token is answered from the token cache without decoding it again'''
+		path = '/users/{user_id}'.format(user_id=self.regular_user.user_id)
+		self.client.get(path, headers=self.admin_token)
+		decodes = REGISTRY.get_sample_value('jwt_operations_total', {'operation': 'decode'})
+		hits = REGISTRY.get_sample_value('cache_hits_total', {'cache': 'token'}) or 0
+		self.client.get(path, headers=self.admin_token)
+		self.assertEqual(REGISTRY.get_sample_value('jwt_operations_total', {'operation': 'decode'}), decodes)
+		self.assertGreater(REGISTRY.get_sample_value('cache_hits_total', {'cache': 'token'}), hits)
+		response = self.client.get('/metrics', headers=METRICS_HEADERS)
+		self.assertIn('cache_hits_total{cache="token"}', response.text)
+		self.assertIn('cache_misses_total{cache="user_auth"}', response.text)
+
+#######################################
+# Bare main unit test function
+#######################################
+if __name__ == '__main__':
+	unittest.main()
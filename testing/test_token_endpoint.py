@@ -5,12 +5,17 @@ Test FastAPI Demo
 '''
 # Standard Imports
 import unittest
+from unittest import mock
 
 # PyPi Imports
+import jwt
 
 # Local Imports
+from routers import token
 from testing.TestFastAPI import TestFastAPI
 from utils.config_utils import get_config
+from utils.rate_limit_utils import LOGIN_ADMISSION
+from utils.revocation_utils import REVOCATIONS
 
 ###############################################################################
 
@@ -22,6 +27,8 @@ TESTING = CONFIG['testing']
 ##############################################################################
 class TestTokenEndpoint(TestFastAPI):
 	'''Test Validator Functions'''
+	use_async_engine = True
+
 	def __init__(self, *args, **kwargs): #pylint: disable=W0235
 		super(TestTokenEndpoint, self).__init__(*args, **kwargs)
 
@@ -75,6 +82,21 @@ class TestTokenEndpoint(TestFastAPI):
 		# * User deleted since last auth
 		self.template_test_endpoint_cases(test_dict=test_dict)
 
+	def test_token_rate_limit(self):
+		'''Test that repeated /token attempts for one username are throttled before authentication'''
+		form_params = {"username": 'rate_limited_username', "password": 'bad_password'}
+		try:
+			statuses = [
+				self.client.post('/token', data=form_params).status_code
+				for _ in range(int(LOGIN_ADMISSION.username_capacity) + 1)
+			]
+			self.assertEqual(statuses[-1], 429, msg='Excess login attempts were not throttled')
+			self.assertTrue(all(status == 401 for status in statuses[:-1]))
+			response = self.client.post('/token', data=form_params)
+			self.assertIn('Retry-After', response.headers)
+		finally:
+			LOGIN_ADMISSION.backend.clear()
+
 	def test_token_refresh_endpoint(self):
 		'''Test if REST API /token/refresh endpoint functions correctly'''
 		test_dict = {
@@ -133,6 +155,33 @@ class TestTokenEndpoint(TestFastAPI):
 		# * User deleted since last auth
 		self.template_test_endpoint_cases(test_dict=test_dict)
 
+	def test_current_user(self):
+		'''Test that check_current_user loads the user through the async session, then answers from the cache'''
+		path = '/users/{user_id}'.format(user_id=self.regular_user.user_id)
+		for attempt in ('loaded', 'cached'):
+			response = self.client.get(path, headers=self.regular_token)
+			self.assertEqual(response.status_code, 200, msg='Current user not {attempt}: {text}'.format(attempt=attempt, text=response.text))
+		response = self.client.get(path, headers=self.inactive_token)
+		self.assertEqual(response.status_code, 401)
+		self.assertEqual(response.json(), {"detail": "Inactive user"})
+
+	def test_claims_authorization(self):
+		'''Test that tokens carry the user's generation and are checked against the revocation table'''
+		with mock.patch.object(token, 'CLAIMS_AUTHORIZATION', True):
+			response = self.client.post('/token', data={
+				"username": TESTING['regular_user'],
+				"password": TESTING['regular_user_password']
+			})
+			self.assertEqual(response.status_code, 200, msg=response.text)
+			access_token = response.json()['access_token']
+			self.assertEqual(jwt.decode(access_token, options={'verify_signature': False})['gen'], 0)
+			response = self.client.get(
+				'/users/{user_id}'.format(user_id=self.regular_user.user_id),
+				headers={"Authorization": 'Bearer ' + access_token}
+			)
+			self.assertEqual(response.status_code, 200, msg=response.text)
+			self.assertFalse(REVOCATIONS.is_stale(), msg='Revocation table not loaded before the claims were trusted')
+
 #######################################
 # Bare main unit test function
 #######################################
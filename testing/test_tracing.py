@@ -0,0 +1,123 @@
+'''
+Test FastAPI Demo
+
+Request tracing
+'''
+# Standard Imports
+import unittest
+
+# PyPi Imports
+try:
+	from opentelemetry.sdk.trace import TracerProvider
+	from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+	from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+	from opentelemetry.trace import SpanKind
+except ImportError: # tracing is optional; these tests need the SDK
+	TracerProvider = None # pylint: disable=invalid-name
+
+# Local Imports
+from testing.TestFastAPI import TestFastAPI
+from utils.config_utils import get_config
+from utils.tracing_utils import set_tracer
+
+###############################################################################
+
+CONFIG = get_config('testing.cfg')
+TESTING = CONFIG['testing']
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_SPAN_ID = '00f067aa0ba902b7'
+
+##############################################################################
+# Testing class
+##############################################################################
+@unittest.skipIf(TracerProvider is None, 'opentelemetry-sdk is not installed')
+class TestTracing(TestFastAPI):
+	'''Test Validator Functions'''
+	def __init__(self, *args, **kwargs): #pylint: disable=W0235
+		super(TestTracing, self).__init__(*args, **kwargs)
+
+	def setUp(self):
+		'''Record every span of the test in memory'''
+		super(TestTracing, self).setUp()
+		self.exporter = InMemorySpanExporter()
+		provider = TracerProvider()
+		provider.add_span_processor(SimpleSpanProcessor(self.exporter))
+		set_tracer(provider.get_tracer(__name__), provider)
+
+	def tearDown(self):
+		'''Turn tracing back off'''
+		set_tracer(None)
+		super(TestTracing, self).tearDown()
+
+	def traced_request(self, method: str, path: str, sampled: bool = True, **kwargs):
+		'''Send a request carrying a W3C traceparent header and return the spans it produced'''
+		headers = dict(kwargs.pop('headers', {}), traceparent='00-{trace_id}-{span_id}-{flags}'.format(
+			trace_id=TRACE_ID,
+			span_id=PARENT_SPAN_ID,
+			flags='01' if sampled else '00'
+		))
+		self.exporter.clear()
+		response = getattr(self.client, method)(path, headers=headers, **kwargs)
+		self.assertLess(response.status_code, 400, msg=response.text)
+		return self.exporter.get_finished_spans()
+
+	def assert_in_request_trace(self, spans, names: set):
+		'''Assert that spans with these names exist and descend from the request's server span'''
+		by_id = {span.context.span_id: span for span in spans}
+		server = [span for span in spans if span.kind == SpanKind.SERVER][0]
+		for name in names:
+			matching = [span for span in spans if span.name == name]
+			self.assertTrue(matching, msg='No {name} span recorded'.format(name=name))
+			span = matching[0]
+			while span.parent is not None and span.parent.span_id in by_id:
+				span = by_id[span.parent.span_id]
+			self.assertIs(span, server, msg='{name} span is not part of the request trace'.format(name=name))
+
+	def test_traceparent_continuation(self):
+		'''Test that the server span continues the caller's trace under the route template'''
+		spans = self.traced_request('get', '/users/{user_id}'.format(user_id=self.regular_user.user_id), headers=self.admin_token)
+		servers = [span for span in spans if span.kind == SpanKind.SERVER]
+		self.assertEqual(len(servers), 1)
+		self.assertEqual(servers[0].name, 'GET /users/{user_id}')
+		self.assertEqual(servers[0].parent.span_id, int(PARENT_SPAN_ID, 16))
+		self.assertEqual(servers[0].attributes['http.status_code'], 200)
+		self.assertTrue(all(span.context.trace_id == int(TRACE_ID, 16) for span in spans))
+
+	def test_unsampled_traceparent(self):
+		'''Test that requests follow the caller's decision not to sample'''
+		spans = self.traced_request('get', '/users/', sampled=False, headers=self.admin_token)
+		self.assertEqual(len(spans), 0)
+
+	def test_child_spans(self):
+		'''Test that middleware, dependency, serialization and SQL spans nest inside the request span'''
+		spans = self.traced_request('get', '/users/{user_id}'.format(user_id=self.regular_user.user_id), headers=self.admin_token)
+		self.assert_in_request_trace(spans, {
+			'db_session_middleware',
+			'admission_middleware',
+			'get_token',
+			'check_current_user',
+			'get_fields',
+			'solve_dependencies',
+			'serialize_response'
+		})
+		sql_spans = [span for span in spans if span.name.startswith('SQL ')]
+		self.assertTrue(sql_spans, msg='No SQL spans recorded')
+		self.assertTrue(all(span.kind == SpanKind.CLIENT and 'db.statement' in span.attributes for span in sql_spans))
+		self.assert_in_request_trace(spans, {span.name for span in sql_spans})
+
+	def test_crypto_spans(self):
+		'''Test that password verification, its executor job and JWT operations get their own spans'''
+		spans = self.traced_request('post', '/token', data={
+			"username": TESTING['regular_user'],
+			"password": TESTING['regular_user_password']
+		})
+		self.assert_in_request_trace(spans, {'solve_dependencies', 'hash_job', 'bcrypt.verify', 'jwt.encode'})
+		spans = self.traced_request('post', '/token/refresh', headers=self.regular_token)
+		self.assert_in_request_trace(spans, {'jwt.decode', 'jwt.encode'})
+
+#######################################
+# Bare main unit test function
+#######################################
+if __name__ == '__main__':
+	unittest.main()
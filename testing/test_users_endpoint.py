@@ -4,14 +4,18 @@ Test FastAPI Demo
 /users
 '''
 # Standard Imports
+import json
 import unittest
+from unittest import mock
 
 # PyPi Imports
 
 # Local Imports
+from database import models
+from routers import users
 from testing.TestFastAPI import TestFastAPI
 from utils.config_utils import get_config
-import utils.user_utils as user_utils
+from utils.query_utils import query_budget
 
 ###############################################################################
 
@@ -25,18 +29,6 @@ class TestUsersEndpoint(TestFastAPI):
 	'''Test Validator Functions'''
 	def __init__(self, *args, **kwargs): #pylint: disable=W0235
 		super(TestUsersEndpoint, self).__init__(*args, **kwargs)
-		self.remove_untaken_usernames()
-
-	def __del__(self):
-		self.remove_untaken_usernames()
-
-	def remove_untaken_usernames(self):
-		'''Clean up users created during user_creation tests'''
-		untaken_usernames = ['untaken_username', 'untaken_username2', 'untaken_username3']
-		for untaken_username in untaken_usernames:
-			user = user_utils.get_user_by_username(self.session, untaken_username)
-			if user:
-				user_utils.delete_user(self.session, user.user_id)
 
 	def test_get_users(self):
 		'''Test if REST API get:/users/ endpoint functions correctly'''
@@ -49,10 +41,212 @@ class TestUsersEndpoint(TestFastAPI):
 					'http_status': 200,
 					'header_params': self.regular_token,
 					'message': 'User list not returned'
+				},
+				{
+					'test_case_description': 'invalid_cursor',
+					'http_status': 422,
+					'expected_data': {
+						'detail': r'^Invalid pagination cursor$'
+					},
+					'header_params': self.regular_token,
+					'query_params': {"cursor": "not-a-cursor"},
+					'message': 'Invalid cursor was not rejected'
+				}
+			]
+		}
+		self.template_test_endpoint_cases(test_dict=test_dict)
+
+	def test_sparse_fieldsets(self):
+		'''Test that ?fields= narrows the user payloads'''
+		response = self.client.get('/users/?fields=user_id,username', headers=self.regular_token)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(set(response.json()[0]), {'user_id', 'username'})
+		response = self.client.get(
+			'/users/{user_id}?fields=email'.format(user_id=self.regular_user.user_id),
+			headers=self.regular_token
+		)
+		self.assertEqual(response.json(), {'email': self.regular_user.email})
+		response = self.client.get('/users/?fields=salted_password_hash', headers=self.regular_token)
+		self.assertEqual(response.status_code, 422, msg='Unknown field was not rejected')
+
+	def test_fast_json_responses(self):
+		'''Test that the orjson fast path returns the same bytes as the pydantic path'''
+		self.session.add(models.User(
+			username='fast_json_user',
+			first_name='Zoë',
+			last_name='Ångström',
+			email='fast_json_user@test.ca',
+			salted_password_hash='unused'
+		))
+		self.session.flush()
+		for path in ('/users/', '/users/{user_id}', '/users/search?q=fast_json'):
+			path = path.format(user_id=self.regular_user.user_id)
+			with mock.patch.object(users, 'FAST_JSON_RESPONSES', False):
+				slow = self.client.get(path, headers=self.regular_token)
+			with mock.patch.object(users, 'FAST_JSON_RESPONSES', True):
+				fast = self.client.get(path, headers=self.regular_token)
+			self.assertEqual(fast.status_code, 200)
+			self.assertEqual(fast.content, slow.content, msg='Fast path body differs for ' + path)
+			self.assertEqual(fast.headers.get('ETag'), slow.headers.get('ETag'), msg='Fast path ETag differs for ' + path)
+		full = self.client.get('/users/', headers=self.regular_token).json()
+		sparse = self.client.get('/users/?fields=email,user_id', headers=self.regular_token)
+		expected = [{'email': user['email'], 'user_id': user['user_id']} for user in full]
+		self.assertEqual(sparse.content, json.dumps(expected, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+	def test_get_users_pagination(self):
+		'''Test that get:/users/ cursors walk the users in order without repeats'''
+		first_page = self.client.get('/users/?limit=1', headers=self.regular_token)
+		self.assertEqual(first_page.status_code, 200)
+		next_cursor = first_page.headers.get('X-Next-Cursor')
+		self.assertTrue(next_cursor, msg='Next cursor not returned for a full page')
+		self.assertIn('rel="next"', first_page.headers.get('Link', ''))
+		second_page = self.client.get('/users/?limit=1&cursor=' + next_cursor, headers=self.regular_token)
+		self.assertEqual(second_page.status_code, 200)
+		self.assertGreater(second_page.json()[0]['user_id'], first_page.json()[0]['user_id'])
+
+	def test_search_users(self):
+		'''Test if REST API get:/users/search endpoint functions correctly'''
+		test_dict = {
+			'http_method': 'get',
+			'path': '/users/search',
+			'test_cases': [
+				{
+					'test_case_description': 'matches_returned',
+					'http_status': 200,
+					'header_params': self.regular_token,
+					'query_params': {"q": "REGULAR_us"},
+					'message': 'Search results not returned'
+				},
+				{
+					'test_case_description': 'missing_query',
+					'http_status': 422,
+					'header_params': self.regular_token,
+					'message': 'Search without a query was not rejected'
+				}
+			]
+		}
+		self.template_test_endpoint_cases(test_dict=test_dict)
+		response = self.client.get('/users/search?q=REGULAR_us', headers=self.regular_token)
+		self.assertEqual(response.json()[0]['user_id'], self.regular_user.user_id)
+
+	def test_export_users(self):
+		'''Test if REST API get:/users/export endpoint functions correctly'''
+		test_dict = {
+			'http_method': 'get',
+			'path': '/users/export',
+			'test_cases': [
+				{
+					'test_case_description': 'ndjson_export',
+					'http_status': 200,
+					'header_params': self.regular_token,
+					'message': 'NDJSON export not returned'
+				},
+				{
+					'test_case_description': 'csv_export',
+					'http_status': 200,
+					'header_params': self.regular_token,
+					'query_params': {"format": "csv"},
+					'message': 'CSV export not returned'
+				},
+				{
+					'test_case_description': 'unknown_format',
+					'http_status': 422,
+					'header_params': self.regular_token,
+					'query_params': {"format": "xml"},
+					'message': 'Unknown export format was not rejected'
+				}
+			]
+		}
+		self.template_test_endpoint_cases(test_dict=test_dict)
+
+	def test_compression(self):
+		'''Test Accept-Encoding negotiation on the user endpoints'''
+		self.session.add_all([
+			models.User(
+				username='compression_user_{index}'.format(index=index),
+				first_name='Compression',
+				last_name='User',
+				email='compression_user_{index}@test.ca'.format(index=index),
+				salted_password_hash='unused'
+			) for index in range(20)
+		])
+		self.session.flush()
+		test_dict = {
+			'http_method': 'get',
+			'path': '/users/',
+			'test_cases': [
+				{
+					'test_case_description': 'gzip_accepted',
+					'http_status': 200,
+					'expected_headers': {
+						'Content-Encoding': r'^gzip$',
+						'Vary': r'.*Accept-Encoding',
+						'ETag': r'^W/"l'
+					},
+					'header_params': dict(self.regular_token, **{'Accept-Encoding': 'gzip'}),
+					'message': 'User list not gzipped with Vary and a weak ETag'
+				},
+				{
+					'test_case_description': 'identity_only',
+					'http_status': 200,
+					'expected_headers': {
+						'Content-Encoding': r'^$',
+						'ETag': r'^"l'
+					},
+					'header_params': dict(self.regular_token, **{'Accept-Encoding': 'identity'}),
+					'message': 'User list compressed for a client that does not accept it'
+				},
+				{
+					'test_case_description': 'gzip_refused',
+					'http_status': 200,
+					'expected_headers': {
+						'Content-Encoding': r'^$'
+					},
+					'header_params': dict(self.regular_token, **{'Accept-Encoding': 'gzip;q=0'}),
+					'message': 'User list compressed for a client that refuses gzip'
+				}
+			]
+		}
+		self.template_test_endpoint_cases(test_dict=test_dict)
+		test_dict = {
+			'http_method': 'get',
+			'path': '/users/{user_id}',
+			'test_cases': [
+				{
+					'test_case_description': 'below_minimum_size',
+					'http_status': 200,
+					'expected_headers': {
+						'Content-Encoding': r'^$',
+						'ETag': r'^"u'
+					},
+					'header_params': dict(self.regular_token, **{'Accept-Encoding': 'gzip'}),
+					'path_params': {"user_id": self.regular_user.user_id},
+					'message': 'Small user body was compressed'
 				}
 			]
 		}
 		self.template_test_endpoint_cases(test_dict=test_dict)
+		test_dict = {
+			'http_method': 'get',
+			'path': '/users/export',
+			'test_cases': [
+				{
+					'test_case_description': 'streamed_export',
+					'http_status': 200,
+					'expected_headers': {
+						'Content-Encoding': r'^gzip$',
+						'Vary': r'.*Accept-Encoding',
+						'Content-Length': r'^$'
+					},
+					'header_params': dict(self.regular_token, **{'Accept-Encoding': 'gzip'}),
+					'message': 'Streamed export not gzipped'
+				}
+			]
+		}
+		self.template_test_endpoint_cases(test_dict=test_dict)
+		response = self.client.get('/users/', headers=dict(self.regular_token, **{'Accept-Encoding': 'gzip'}))
+		not_modified = self.client.get('/users/', headers=dict(self.regular_token, **{'If-None-Match': response.headers['ETag']}))
+		self.assertEqual(not_modified.status_code, 304, msg='Weakened ETag did not produce 304')
 
 	def test_create_user(self):
 		'''Test if REST API post:/users/ endpoint functions correctly'''
@@ -105,6 +299,22 @@ class TestUsersEndpoint(TestFastAPI):
 					},
 					'message': 'Username was not rejected as duplicate'
 				},
+				{
+					'test_case_description': 'email_unavailable',
+					'http_status': 409,
+					'expected_data': {
+						'detail': r'^Email already registered$'
+					},
+					'header_params': self.admin_token,
+					'body_params': {
+						"username": 'untaken_username3',
+						"first_name": "Test",
+						"last_name": "User",
+						"email": self.regular_user.email,
+						"password": "string"
+					},
+					'message': 'Email was not rejected as duplicate'
+				},
 				{
 					'test_case_description': 'invalid_email',
 					'http_status': 422,
@@ -122,6 +332,28 @@ class TestUsersEndpoint(TestFastAPI):
 		}
 		self.template_test_endpoint_cases(test_dict=test_dict)
 
+	def test_bulk_create_users(self):
+		'''Test if REST API post:/users/bulk endpoint functions correctly'''
+		records = [
+			{
+				"username": username,
+				"first_name": "Test",
+				"last_name": "User",
+				"email": "{username}@test.ca".format(username=username),
+				"password": "string"
+			}
+			for username in ['bulk_username1', 'bulk_username2', TESTING['regular_user'], 'bulk_username1']
+		]
+		forbidden = self.client.post('/users/bulk', json=records, headers=self.regular_token)
+		self.assertEqual(forbidden.status_code, 403, msg='Insufficient privilege not returned')
+		response = self.client.post('/users/bulk', json=records, headers=self.admin_token)
+		self.assertEqual(response.status_code, 200, msg=response.text)
+		statuses = [result['status'] for result in response.json()]
+		self.assertEqual(statuses, ['created', 'created', 'conflict', 'conflict'])
+		# Refused on the record count alone, before any record is validated
+		oversized = self.client.post('/users/bulk', json=[{}] * (users.BULK_USER_LIMIT + 1), headers=self.admin_token)
+		self.assertEqual(oversized.status_code, 413, msg=oversized.text)
+
 	def test_get_user(self):
 		'''Test if REST API get:/users/{user_id} endpoint functions correctly'''
 		test_dict = {
@@ -149,6 +381,43 @@ class TestUsersEndpoint(TestFastAPI):
 		}
 		self.template_test_endpoint_cases(test_dict=test_dict)
 
+	def test_conditional_requests(self):
+		'''Test ETag, If-None-Match and If-Match handling on the user endpoints'''
+		path = '/users/{user_id}'.format(user_id=self.regular_user.user_id)
+		response = self.client.get(path, headers=self.regular_token)
+		etag = response.headers['ETag']
+		not_modified = self.client.get(path, headers=dict(self.regular_token, **{'If-None-Match': etag}))
+		self.assertEqual(not_modified.status_code, 304, msg='Current ETag did not produce 304')
+		list_response = self.client.get('/users/', headers=self.regular_token)
+		list_not_modified = self.client.get(
+			'/users/',
+			headers=dict(self.regular_token, **{'If-None-Match': list_response.headers['ETag']})
+		)
+		self.assertEqual(list_not_modified.status_code, 304, msg='Current list ETag did not produce 304')
+		body = {"first_name": "Regular", "last_name": "User", "email": self.regular_user.email}
+		stale = self.client.put(path, json=body, headers=dict(self.admin_token, **{'If-Match': '"u{user_id}-v0"'.format(
+			user_id=self.regular_user.user_id
+		)}))
+		self.assertEqual(stale.status_code, 412, msg='Stale If-Match was not rejected')
+		updated = self.client.put(path, json=body, headers=dict(self.admin_token, **{'If-Match': etag}))
+		self.assertEqual(updated.status_code, 200, msg='Current If-Match was rejected')
+		self.assertNotEqual(updated.headers['ETag'], etag, msg='ETag did not change after an update')
+
+	def test_query_budget(self):
+		'''Test that reading a user stays within its query budget once the caller is cached'''
+		path = '/users/{user_id}'.format(user_id=self.regular_user.user_id)
+		self.client.get(path, headers=self.regular_token)
+		self.client.get(path, headers=self.admin_token)
+		with query_budget(1, allow_duplicates=False):
+			response = self.client.get(path, headers=self.regular_token)
+		self.assertIn('Server-Timing', response.headers, msg='Query totals not reported')
+		with query_budget(2, allow_duplicates=False):
+			self.client.put(path, json={
+				"first_name": "Regular",
+				"last_name": "User",
+				"email": self.regular_user.email
+			}, headers=self.admin_token)
+
 	def test_update_user(self):
 		'''Test if REST API put:/users/{user_id} endpoint functions correctly'''
 		test_dict = {
@@ -394,6 +663,50 @@ class TestUsersEndpoint(TestFastAPI):
 		}
 		self.template_test_endpoint_cases(test_dict=test_dict)
 
+	def test_bulk_set_active(self):
+		'''Test if REST API put:/users/bulk/set_active endpoint functions correctly'''
+		test_user = self.get_test_user(TESTING['test_user'], TESTING['test_user_password'])
+		test_dict = {
+			'http_method': 'put',
+			'path': '/users/bulk/set_active',
+			'test_cases': [
+				{
+					'test_case_description': 'admin_sets_active',
+					'http_status': 200,
+					'header_params': self.admin_token,
+					'body_params': {"user_ids": [test_user.user_id, -1], "active": True},
+					'message': 'Users active flag not changed'
+				},
+				{
+					'test_case_description': 'insufficient_privilege',
+					'http_status': 403,
+					'expected_data': {
+						'detail': r'^Authenticated user lacks administrative privileges$'
+					},
+					'header_params': self.regular_token,
+					'body_params': {"user_ids": [test_user.user_id], "active": True},
+					'message': 'Forbidden was not returned'
+				},
+				{
+					'test_case_description': 'admin_deprivileging',
+					'http_status': 403,
+					'expected_data': {
+						'detail': r'^You may not change your own administrative privileges or active status$'
+					},
+					'header_params': self.admin_token,
+					'body_params': {"user_ids": [test_user.user_id, self.admin_user.user_id], "active": False},
+					'message': 'Admin could change own active state'
+				}
+			]
+		}
+		self.template_test_endpoint_cases(test_dict=test_dict)
+		response = self.client.put(
+			'/users/bulk/set_admin',
+			json={"user_ids": [test_user.user_id, -1], "admin": False},
+			headers=self.admin_token
+		)
+		self.assertEqual(response.json(), {"updated": [test_user.user_id], "missing": [-1]})
+
 #######################################
 # Bare main unit test function
 #######################################
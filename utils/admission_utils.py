@@ -0,0 +1,152 @@
+'''
+FastAPI Demo
+
+Per route group admission control
+'''
+# Standard Imports
+import asyncio
+from collections import deque
+import contextlib
+
+# PyPi Imports
+from starlette.responses import JSONResponse
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
+
+# Local Imports
+from database.setup import POOL_OPTIONS
+from utils.config_utils import get_config
+from utils.tracing_utils import traced
+
+###############################################################################
+
+CONFIG = get_config('api.cfg')
+ADMISSION_ENABLED = CONFIG.getboolean('admission', 'ENABLED', fallback=True)
+RETRY_AFTER_SECONDS = CONFIG.getint('admission', 'RETRY_AFTER_SECONDS', fallback=1)
+
+###############################################################################
+
+class AdmissionRejectedError(Exception):
+	'''Raised when a route group's wait queue is full or its queue deadline passes'''
+	def __init__(self, group: str, reason: str):
+		super().__init__('{group} {reason}'.format(group=group, reason=reason))
+		self.group = group
+		self.reason = reason
+
+
+class AdmissionGate:
+	'''Bounds the in-flight requests of one route group, with a bounded FIFO queue behind it'''
+	def __init__(self, group: str, max_in_flight: int, max_queue: int, queue_timeout: float):
+		self.group = group
+		self.max_in_flight = max_in_flight
+		self.max_queue = max_queue
+		self.queue_timeout = queue_timeout
+		self.in_flight = 0
+		self.rejected = 0
+		self.timed_out = 0
+		self._waiters = deque()
+
+	async def acquire(self):
+		'''Take an in-flight slot, queueing for at most queue_timeout seconds'''
+		if self.in_flight < self.max_in_flight and not self._waiters:
+			self.in_flight += 1
+			return
+		if len(self._waiters) >= self.max_queue:
+			self.rejected += 1
+			raise AdmissionRejectedError(self.group, 'queue full')
+		waiter = asyncio.get_running_loop().create_future()
+		self._waiters.append(waiter)
+		try:
+			await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+		except BaseException as exc:
+			# A slot handed over just as the wait was abandoned must be passed on
+			if waiter.done() and not waiter.cancelled():
+				self.release()
+			if isinstance(exc, asyncio.TimeoutError):
+				self.timed_out += 1
+				raise AdmissionRejectedError(self.group, 'queue timeout')
+			raise
+		finally:
+			with contextlib.suppress(ValueError):
+				self._waiters.remove(waiter)
+
+	def release(self):
+		'''Hand the slot to the oldest live waiter, or free it'''
+		while self._waiters:
+			waiter = self._waiters.popleft()
+			if not waiter.done():
+				waiter.set_result(None)
+				return
+		self.in_flight -= 1
+
+	def stats(self):
+		'''Return the gate's current load and rejection counts'''
+		return {
+			'in_flight': self.in_flight,
+			'queued': len(self._waiters),
+			'rejected': self.rejected,
+			'timed_out': self.timed_out
+		}
+
+
+def build_gate(group: str, max_in_flight: int, max_queue: int, queue_timeout: float):
+	'''Build a route group's gate from the [admission] config section'''
+	prefix = group.upper() + '_'
+	return AdmissionGate(
+		group=group,
+		max_in_flight=CONFIG.getint('admission', prefix + 'MAX_IN_FLIGHT', fallback=max_in_flight),
+		max_queue=CONFIG.getint('admission', prefix + 'MAX_QUEUE', fallback=max_queue),
+		queue_timeout=CONFIG.getfloat('admission', prefix + 'QUEUE_TIMEOUT_SECONDS', fallback=queue_timeout)
+	)
+
+###############################################################################
+
+ADMISSION_GATES = {
+	'/token': build_gate('token', max_in_flight=16, max_queue=64, queue_timeout=2),
+	# The sync /users routes each hold a pooled connection, so by default admit no more than the pool can serve
+	'/users': build_gate(
+		'users',
+		max_in_flight=POOL_OPTIONS['pool_size'] + POOL_OPTIONS['max_overflow'],
+		max_queue=60,
+		queue_timeout=1
+	)
+}
+
+###############################################################################
+
+def get_admission_gate(path: str):
+	'''Return the gate for the route group a path belongs to, if any'''
+	for prefix, gate in ADMISSION_GATES.items():
+		if path == prefix or path.startswith(prefix + '/'):
+			return gate
+	return None
+
+class AdmissionMiddleware:
+	'''
+	ASGI middleware running each request inside its route group's gate, shedding it with a 503 under overload.
+	The slot is held until the response body has been sent, so streamed exports count for their whole duration.
+	'''
+	def __init__(self, app, enabled: bool = ADMISSION_ENABLED, retry_after: int = RETRY_AFTER_SECONDS):
+		self.app = app
+		self.enabled = enabled
+		self.retry_after = retry_after
+
+	@traced('admission_middleware')
+	async def __call__(self, scope, receive, send):
+		gate = get_admission_gate(scope['path']) if self.enabled and scope['type'] == 'http' else None
+		if gate is None:
+			await self.app(scope, receive, send)
+			return
+		try:
+			await gate.acquire()
+		except AdmissionRejectedError:
+			response = JSONResponse(
+				{"detail": "Server busy. Retry shortly"},
+				status_code=HTTP_503_SERVICE_UNAVAILABLE,
+				headers={"Retry-After": str(self.retry_after)}
+			)
+			await response(scope, receive, send)
+			return
+		try:
+			await self.app(scope, receive, send)
+		finally:
+			gate.release()
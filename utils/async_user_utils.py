@@ -0,0 +1,171 @@
+'''
+FastAPI Demo
+
+Async user utils
+'''
+# Standard Imports
+
+# PyPi Imports
+from sqlalchemy import (
+	select,
+	update
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Local Imports
+from database import models
+from data_schemas import schemas
+from utils import hash_utils
+from utils.revocation_utils import CLAIMS_AUTHORIZATION
+from utils.user_utils import (
+	VERSIONED_USER_COLUMNS,
+	UserSnapshot,
+	bump_token_generations_statement,
+	forget_user_auth,
+	hash_password,
+	user_columns,
+	verify_password
+)
+
+###############################################################################
+
+async def get_user(database: AsyncSession, user_id: int, fields: tuple = None):
+	'''Get a specific user by user_id, selecting only the requested public fields'''
+	result = await database.execute(select(*user_columns(fields)).filter(models.User.user_id == user_id))
+	return result.first()
+
+async def bump_token_generation(database: AsyncSession, user_id: int):
+	'''Revoke a user's claims-based tokens as part of the current transaction'''
+	if not CLAIMS_AUTHORIZATION:
+		return None
+	result = await database.execute(bump_token_generations_statement([user_id]))
+	return dict(result.fetchall()).get(user_id)
+
+async def get_token_generation(database: AsyncSession, user_id: int):
+	'''Get the generation new tokens for a user should carry'''
+	result = await database.execute(
+		select(models.TokenRevocation.token_generation).filter(models.TokenRevocation.user_id == user_id)
+	)
+	return result.scalar() or 0
+
+async def get_user_snapshot(database: AsyncSession, user_id: int):
+	'''Get only the authorization relevant fields of a user'''
+	result = await database.execute(
+		select(
+			models.User.user_id,
+			models.User.username,
+			models.User.active_boolean,
+			models.User.admin_boolean
+		).filter(models.User.user_id == user_id)
+	)
+	row = result.first()
+	return UserSnapshot(*row) if row else None
+
+async def get_user_by_email(database: AsyncSession, email: str):
+	'''Get a specific user by email address'''
+	result = await database.execute(select(models.User).filter(models.User.email == email))
+	return result.scalars().first()
+
+async def get_user_by_username(database: AsyncSession, username: str):
+	'''Get a specific user by username'''
+	result = await database.execute(select(models.User).filter(models.User.username == username))
+	return result.scalars().first()
+
+async def get_users(database: AsyncSession, skip: int = 0, limit: int = 100, after: int = None, fields: tuple = None):
+	'''Get a page of users ordered by user_id, starting after the given user_id'''
+	query = select(*user_columns(fields))
+	if after is not None:
+		query = query.filter(models.User.user_id > after)
+	query = query.order_by(models.User.user_id)
+	if skip:
+		query = query.offset(skip)
+	result = await database.execute(query.limit(limit))
+	return result.all()
+
+async def authenticate_user(database: AsyncSession, username: str, password: str):
+	'''Authenticate a user'''
+	user = await get_user_by_username(database, username)
+	if not user:
+		return False
+	if not await hash_utils.run_async(verify_password, username, password, user.salted_password_hash):
+		return False
+	return user
+
+async def create_user(database: AsyncSession, user: schemas.UserCreate):
+	'''Create a new user, returning None if the username or email is already registered'''
+	statement = insert(models.User).values(
+		username=user.username,
+		first_name=user.first_name,
+		last_name=user.last_name,
+		email=user.email,
+		salted_password_hash=await hash_utils.run_async(hash_password, user.username, user.password)
+	).on_conflict_do_nothing()
+	result = await database.execute(statement.returning(*VERSIONED_USER_COLUMNS))
+	db_user = result.first()
+	await database.commit()
+	return db_user
+
+async def update_user_row(database: AsyncSession, user_id: int, revoke_tokens: bool = False, expected_version: int = None, **values):
+	'''Update one user with a single UPDATE ... RETURNING, returning None if there is no such user (at expected_version)'''
+	statement = update(models.User.__table__).where(models.User.user_id == user_id)
+	if expected_version is not None:
+		statement = statement.where(models.User.row_version == expected_version)
+	statement = statement.values(row_version=models.User.row_version + 1, **values)
+	result = await database.execute(statement.returning(*VERSIONED_USER_COLUMNS))
+	user = result.first()
+	if user is None:
+		await database.rollback()
+		return None
+	generation = await bump_token_generation(database, user_id) if revoke_tokens else None
+	await database.commit()
+	if revoke_tokens:
+		forget_user_auth(user_id, generation)
+	return user
+
+async def update_user(database: AsyncSession, user_id: int, data: schemas.UserUpdate, expected_version: int = None):
+	'''Update a user, optionally only if it is still at expected_version'''
+	values = {
+		field: value for field, value in (
+			('first_name', data.first_name),
+			('last_name', data.last_name),
+			('email', data.email)
+		) if value
+	}
+	if not values:
+		user = await get_user(database=database, user_id=user_id)
+		if user is None or expected_version not in (None, user.row_version):
+			return None
+		return user
+	return await update_user_row(database, user_id, expected_version=expected_version, **values)
+
+async def delete_user(database: AsyncSession, user_id: int):
+	'''Delete a user'''
+	statement = models.User.__table__.delete().where(models.User.user_id == user_id)
+	result = await database.execute(statement.returning(*VERSIONED_USER_COLUMNS))
+	user = result.first()
+	if user is None:
+		await database.rollback()
+		return None
+	generation = await bump_token_generation(database, user_id)
+	await database.commit()
+	forget_user_auth(user_id, generation)
+	return user
+
+async def set_password(database: AsyncSession, user_id: int, password: str):
+	'''Change a password'''
+	# The username salts the hash, so it has to be read before the update
+	result = await database.execute(select(models.User.username).filter(models.User.user_id == user_id))
+	username = result.scalar()
+	if username is None:
+		return None
+	password_hash = await hash_utils.run_async(hash_password, username, password)
+	return await update_user_row(database, user_id, revoke_tokens=True, salted_password_hash=password_hash)
+
+async def set_user_admin(database: AsyncSession, user_id: int, admin: bool):
+	'''Set the admin flag on a user'''
+	return await update_user_row(database, user_id, revoke_tokens=True, admin_boolean=admin)
+
+async def set_user_active(database: AsyncSession, user_id: int, active: bool):
+	'''Set the active flag on a user'''
+	return await update_user_row(database, user_id, revoke_tokens=True, active_boolean=active)
@@ -0,0 +1,95 @@
+'''
+FastAPI Demo
+
+Cache utils
+'''
+# Standard Imports
+import asyncio
+from collections import OrderedDict
+import threading
+import time
+
+# Local Imports
+from utils.metrics_utils import (
+	CACHE_EVICTIONS,
+	CACHE_HITS,
+	CACHE_MISSES
+)
+
+###############################################################################
+
+class TTLCache:
+	'''Thread-safe LRU cache whose entries expire after a time-to-live'''
+	def __init__(self, name: str, max_size: int, ttl: float):
+		self.name = name
+		self.max_size = max_size
+		self.ttl = ttl
+		self._hits = CACHE_HITS.labels(name)
+		self._misses = CACHE_MISSES.labels(name)
+		self._evictions = CACHE_EVICTIONS.labels(name)
+		self._entries = OrderedDict()
+		self._loading = dict()
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		'''Return the cached value for key, or None if it is missing or expired'''
+		now = time.monotonic()
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None or entry[0] <= now:
+				if entry is not None:
+					del self._entries[key]
+				self._misses.inc()
+				return None
+			self._entries.move_to_end(key)
+			self._hits.inc()
+			return entry[1]
+
+	def set(self, key, value, expires_at: float = None):
+		'''Cache a value until expires_at (time.monotonic based) or for the default TTL'''
+		with self._lock:
+			self._store(key, value, expires_at)
+
+	def invalidate(self, key):
+		'''Drop a cached value, and any lookup of it still in flight'''
+		with self._lock:
+			self._entries.pop(key, None)
+			self._loading.pop(key, None)
+
+	def clear(self):
+		'''Drop every cached value'''
+		with self._lock:
+			self._entries.clear()
+			self._loading.clear()
+
+	async def get_or_load(self, key, loader):
+		'''Return the cached value for key, sharing a single loader() call between concurrent misses'''
+		value = self.get(key)
+		if value is not None:
+			return value
+		with self._lock:
+			task = self._loading.get(key)
+			if task is None:
+				task = asyncio.ensure_future(loader())
+				self._loading[key] = task
+				task.add_done_callback(lambda done: self._finish_load(key, done))
+		return await asyncio.shield(task)
+
+	def _store(self, key, value, expires_at: float = None):
+		'''Insert an entry and evict the least recently used ones; the lock must be held'''
+		if expires_at is None:
+			expires_at = time.monotonic() + self.ttl
+		self._entries[key] = (expires_at, value)
+		self._entries.move_to_end(key)
+		while len(self._entries) > self.max_size:
+			self._entries.popitem(last=False)
+			self._evictions.inc()
+
+	def _finish_load(self, key, task):
+		'''Cache a completed load unless it was invalidated while in flight'''
+		with self._lock:
+			if self._loading.get(key) is not task:
+				return
+			del self._loading[key]
+			if not task.cancelled() and task.exception() is None and task.result() is not None:
+				self._store(key, task.result())
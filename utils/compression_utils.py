@@ -0,0 +1,158 @@
+'''
+FastAPI Demo
+
+Response compression middleware
+'''
+# Standard Imports
+import zlib
+
+# PyPi Imports
+from starlette.datastructures import (
+	Headers,
+	MutableHeaders
+)
+try:
+	import brotli
+except ImportError: # brotli is optional; gzip is always available
+	brotli = None # pylint: disable=invalid-name
+
+# Local Imports
+from utils.config_utils import get_config
+
+###############################################################################
+
+CONFIG = get_config('api.cfg')
+COMPRESSION_ENABLED = CONFIG.getboolean('compression', 'ENABLED', fallback=True)
+MINIMUM_SIZE = CONFIG.getint('compression', 'MINIMUM_SIZE', fallback=1024)
+GZIP_LEVEL = CONFIG.getint('compression', 'GZIP_LEVEL', fallback=6)
+BROTLI_LEVEL = CONFIG.getint('compression', 'BROTLI_LEVEL', fallback=4)
+CONTENT_TYPES = tuple(
+	content_type.strip() for content_type in CONFIG.get(
+		'compression',
+		'CONTENT_TYPES',
+		fallback='application/json,application/x-ndjson,text/csv,text/html,text/plain'
+	).split(',') if content_type.strip()
+)
+EXCLUDED_PATHS = tuple(
+	path.strip() for path in CONFIG.get('compression', 'EXCLUDED_PATHS', fallback='/token,/token/refresh').split(',')
+	if path.strip()
+)
+
+###############################################################################
+
+def choose_encoding(accept_encoding: str):
+	'''Pick br or gzip from an Accept-Encoding header, honouring q=0'''
+	accepted = dict()
+	for item in accept_encoding.split(','):
+		coding, _, params = item.strip().partition(';')
+		quality = 1.0
+		params = params.strip()
+		if params.startswith('q='):
+			try:
+				quality = float(params[2:])
+			except ValueError:
+				quality = 0.0
+		accepted[coding.strip().lower()] = quality
+	if brotli is not None and accepted.get('br', 0) > 0:
+		return 'br'
+	if accepted.get('gzip', accepted.get('*', 0)) > 0:
+		return 'gzip'
+	return None
+
+
+class StreamCompressor:
+	'''Incremental gzip or brotli compressor that flushes after every chunk'''
+	def __init__(self, encoding: str, gzip_level: int, brotli_level: int):
+		self.encoding = encoding
+		if encoding == 'br':
+			self._compressor = brotli.Compressor(quality=brotli_level)
+		else:
+			self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+	def compress(self, data: bytes, final: bool):
+		'''Compress a chunk, flushing so the client can decode it straight away'''
+		if self.encoding == 'br':
+			output = self._compressor.process(data)
+			return output + (self._compressor.finish() if final else self._compressor.flush())
+		output = self._compressor.compress(data)
+		return output + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+	'''
+	ASGI middleware compressing responses with gzip (or brotli when installed).
+	Only allowlisted content types are compressed; bodies under minimum_size (by Content-Length
+	when the body arrives in chunks) and excluded paths are sent as is. Streaming responses are
+	compressed chunk by chunk. Strong ETags on compressed responses are weakened, still matching
+	If-None-Match, and if_match_version accepts the weakened user ETags too.
+	'''
+	def __init__(
+		self,
+		app,
+		minimum_size: int = MINIMUM_SIZE,
+		gzip_level: int = GZIP_LEVEL,
+		brotli_level: int = BROTLI_LEVEL,
+		content_types: tuple = CONTENT_TYPES,
+		excluded_paths: tuple = EXCLUDED_PATHS
+	):
+		self.app = app
+		self.minimum_size = minimum_size
+		self.gzip_level = gzip_level
+		self.brotli_level = brotli_level
+		self.content_types = content_types
+		self.excluded_paths = excluded_paths
+
+	async def __call__(self, scope, receive, send):
+		if scope['type'] != 'http' or scope['path'] in self.excluded_paths:
+			await self.app(scope, receive, send)
+			return
+		encoding = choose_encoding(Headers(scope=scope).get('accept-encoding', ''))
+		if encoding is None:
+			await self.app(scope, receive, send)
+			return
+		state = {'start': None, 'compressor': None, 'passthrough': False}
+
+		async def send_compressed(message):
+			if message['type'] == 'http.response.start':
+				state['start'] = message
+				return
+			if message['type'] != 'http.response.body' or state['passthrough']:
+				await send(message)
+				return
+			body = message.get('body', b'')
+			more_body = message.get('more_body', False)
+			if state['compressor'] is None:
+				headers = MutableHeaders(raw=state['start']['headers'])
+				# Bodies passed through @app.middleware("http") arrive in chunks but keep their Content-Length
+				content_length = headers.get('content-length', '')
+				size = int(content_length) if content_length.isdigit() else None if more_body else len(body)
+				if not self.should_compress(headers) or (size is not None and size < self.minimum_size):
+					state['passthrough'] = True
+					await send(state['start'])
+					await send(message)
+					return
+				state['compressor'] = StreamCompressor(encoding, self.gzip_level, self.brotli_level)
+				compressed = state['compressor'].compress(body, final=not more_body)
+				headers['Content-Encoding'] = encoding
+				headers.add_vary_header('Accept-Encoding')
+				etag = headers.get('etag')
+				if etag and not etag.startswith('W/'):
+					# The encoded bytes differ from the ones the strong ETag vouches for
+					headers['ETag'] = 'W/' + etag
+				if more_body:
+					del headers['Content-Length']
+				else:
+					headers['Content-Length'] = str(len(compressed))
+				await send(state['start'])
+			else:
+				compressed = state['compressor'].compress(body, final=not more_body)
+			await send({'type': 'http.response.body', 'body': compressed, 'more_body': more_body})
+
+		await self.app(scope, receive, send_compressed)
+
+	def should_compress(self, headers: MutableHeaders):
+		'''Whether a response with these headers is eligible for compression'''
+		if 'content-encoding' in headers:
+			return False
+		content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+		return content_type in self.content_types
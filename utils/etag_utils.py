@@ -0,0 +1,65 @@
+'''
+FastAPI Demo
+
+ETag utils
+'''
+# Standard Imports
+import hashlib
+import re
+
+###############################################################################
+
+USER_ETAG_PATTERN = re.compile(r'^"u(?P<user_id>\d+)-v(?P<row_version>\d+)"$')
+
+###############################################################################
+
+def fields_suffix(fields: tuple = None):
+	'''Distinguish sparse fieldset representations, which must not share an ETag with the full one'''
+	if not fields:
+		return ''
+	return '-f' + hashlib.sha1(','.join(fields).encode('ascii')).hexdigest()[:12]
+
+def user_etag(user, fields: tuple = None):
+	'''Strong ETag of a single user row'''
+	return '"u{user_id}-v{row_version}{suffix}"'.format(
+		user_id=user.user_id,
+		row_version=user.row_version,
+		suffix=fields_suffix(fields)
+	)
+
+def users_etag(users, fields: tuple = None):
+	'''Strong ETag of a page of user rows, derived from their ids and versions'''
+	digest = hashlib.sha1()
+	for user in users:
+		digest.update('{user_id}:{row_version},'.format(user_id=user.user_id, row_version=user.row_version).encode('ascii'))
+	return '"l{digest}{suffix}"'.format(digest=digest.hexdigest(), suffix=fields_suffix(fields))
+
+def split_etags(header_value: str):
+	'''Split an If-Match / If-None-Match header into its entity tags'''
+	return [etag.strip() for etag in header_value.split(',') if etag.strip()]
+
+def if_none_match(header_value: str, etag: str):
+	'''Whether an If-None-Match header matches etag, meaning the client copy is current'''
+	if not header_value:
+		return False
+	for candidate in split_etags(header_value):
+		if candidate == '*' or candidate == etag or candidate == 'W/' + etag:
+			return True
+	return False
+
+def if_match_version(header_value: str, user_id: int):
+	'''
+	The row_version an If-Match header requires for user_id.
+	Returns None for "*" and raises ValueError if no tag in the header is an ETag of that user.
+	A user ETag names a row version whatever the content coding, so the W/ form that
+	CompressionMiddleware sends for compressed bodies is accepted as well.
+	'''
+	for candidate in split_etags(header_value):
+		if candidate == '*':
+			return None
+		if candidate.startswith('W/'):
+			candidate = candidate[2:]
+		match = USER_ETAG_PATTERN.match(candidate)
+		if match and int(match.group('user_id')) == user_id:
+			return int(match.group('row_version'))
+	raise ValueError('If-Match does not name a version of this user')
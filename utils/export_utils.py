@@ -0,0 +1,57 @@
+'''
+FastAPI Demo
+
+Export utils
+'''
+# Standard Imports
+import csv
+import io
+import json
+
+# Local Imports
+from utils.user_utils import (
+	USER_FIELDS,
+	stream_users
+)
+
+###############################################################################
+
+EXPORT_BATCH_SIZE = 1000
+
+###############################################################################
+
+def export_users_ndjson(session_factory, batch_size: int = EXPORT_BATCH_SIZE):
+	'''Yield every user as newline delimited JSON, one batch of lines at a time'''
+	database = session_factory()
+	try:
+		lines = []
+		for row in stream_users(database, batch_size=batch_size):
+			lines.append(json.dumps(dict(zip(USER_FIELDS, row))))
+			if len(lines) >= batch_size:
+				yield '\n'.join(lines) + '\n'
+				lines = []
+		if lines:
+			yield '\n'.join(lines) + '\n'
+	finally:
+		database.close()
+
+def export_users_csv(session_factory, batch_size: int = EXPORT_BATCH_SIZE):
+	'''Yield every user as CSV, starting with the header row'''
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	writer.writerow(USER_FIELDS)
+	yield buffer.getvalue()
+	database = session_factory()
+	try:
+		buffer.seek(0)
+		buffer.truncate()
+		for count, row in enumerate(stream_users(database, batch_size=batch_size), start=1):
+			writer.writerow(row)
+			if count % batch_size == 0:
+				yield buffer.getvalue()
+				buffer.seek(0)
+				buffer.truncate()
+		if buffer.tell():
+			yield buffer.getvalue()
+	finally:
+		database.close()
@@ -0,0 +1,103 @@
+'''
+FastAPI Demo
+
+Password hashing executor
+'''
+# Standard Imports
+import asyncio
+from concurrent.futures import (
+	ProcessPoolExecutor,
+	ThreadPoolExecutor
+)
+import contextvars
+import os
+import threading
+
+# Local Imports
+from utils.config_utils import get_config
+from utils.tracing_utils import (
+	start_span,
+	traced
+)
+
+###############################################################################
+
+CONFIG = get_config('security.cfg')
+SECURITY = CONFIG['security']
+HASH_EXECUTOR = SECURITY.get('HASH_EXECUTOR', 'thread')
+HASH_WORKERS = SECURITY.getint('HASH_WORKERS', os.cpu_count() or 1)
+HASH_QUEUE_DEPTH = SECURITY.getint('HASH_QUEUE_DEPTH', 64)
+# Bulk jobs leave one worker free so logins and single-user writes are not starved
+BULK_HASH_WORKERS = max(HASH_WORKERS - 1, 1)
+
+###############################################################################
+
+class HashQueueFullError(Exception):
+	'''Raised when the hashing executor already has its maximum number of jobs waiting'''
+
+
+# bcrypt releases the GIL, so threads scale across cores; processes are available
+# for hashing backends that do not.
+if HASH_EXECUTOR == 'process':
+	EXECUTOR = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+else:
+	EXECUTOR = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='hash')
+
+_SLOTS = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_DEPTH)
+# Shared by every batch, so concurrent bulk requests still leave a worker free
+_BULK_SLOTS = threading.BoundedSemaphore(BULK_HASH_WORKERS)
+
+###############################################################################
+
+def _release_slot(_future):
+	'''Free the executor slot held by a finished job'''
+	_SLOTS.release()
+
+def _in_caller_context(function, args):
+	'''Run thread jobs in a copy of the caller's context so its trace span stays the parent'''
+	if HASH_EXECUTOR == 'process':
+		return function, args
+	return contextvars.copy_context().run, (function,) + tuple(args)
+
+def submit(function, *args):
+	'''Queue a hashing job, refusing it if the executor queue is full'''
+	if not _SLOTS.acquire(blocking=False):
+		raise HashQueueFullError()
+	function, args = _in_caller_context(function, args)
+	try:
+		future = EXECUTOR.submit(function, *args)
+	except BaseException:
+		_SLOTS.release()
+		raise
+	future.add_done_callback(_release_slot)
+	return future
+
+# The job's own spans are lost in worker processes, so the caller's span covers the queue wait and the job
+def run(function, *args):
+	'''Run a hashing job on the executor and wait for the result'''
+	with start_span('hash_job', {'hash.executor': HASH_EXECUTOR}):
+		return submit(function, *args).result()
+
+async def run_async(function, *args):
+	'''Run a hashing job on the executor without blocking the event loop'''
+	with start_span('hash_job', {'hash.executor': HASH_EXECUTOR}):
+		return await asyncio.wrap_future(submit(function, *args))
+
+@traced('hash_batch')
+def run_many(function, arguments: list):
+	'''Run a batch of hashing jobs, feeding at most BULK_HASH_WORKERS of them to the executor at a time'''
+	futures = []
+	for job_arguments in arguments:
+		_BULK_SLOTS.acquire()
+		_SLOTS.acquire()
+		job_function, job_arguments = _in_caller_context(function, job_arguments)
+		try:
+			future = EXECUTOR.submit(job_function, *job_arguments)
+		except BaseException:
+			_SLOTS.release()
+			_BULK_SLOTS.release()
+			raise
+		future.add_done_callback(_release_slot)
+		future.add_done_callback(lambda _future: _BULK_SLOTS.release())
+		futures.append(future)
+	return [future.result() for future in futures]
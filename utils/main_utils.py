@@ -5,13 +5,56 @@ Main Utils
 '''
 # PyPi Imports
 from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
+
+# Local Imports
+from database.setup import (
+	async_session_local,
+	session_local
+)
+from utils.tracing_utils import traced
 
 ###############################################################################
 
+@traced()
 def get_db(request: Request):
-	'''Return the database session from the request state'''
+	'''Return the database session for the request, opening it on first use'''
+	if request.state.db is None:
+		request.state.db = session_local()
 	return request.state.db
 
+def get_session_factory():
+	'''Return the factory for sessions that must outlive the request, such as streamed responses'''
+	return session_local
+
+def get_async_session_factory():
+	'''Return the factory for async sessions that must not share the request's, such as cache loads'''
+	return async_session_local
+
+@traced()
+def get_async_db(request: Request):
+	'''Return the async database session for the request, opening it on first use'''
+	if request.state.async_db is None:
+		request.state.async_db = async_session_local()
+	return request.state.async_db
+
+async def close_db_sessions(request: Request):
+	'''Close whichever database sessions the request actually opened'''
+	if request.state.db is not None:
+		request.state.db.close()
+	if request.state.async_db is not None:
+		await request.state.async_db.close()
+
+@traced()
 def get_current_user(request: Request):
 	'''Return the database session from the request state'''
 	return request.state.current_user
+
+async def hash_queue_full_handler(request: Request, exc: Exception): #pylint: disable=unused-argument
+	'''Turn a full password hashing queue into a retryable 503'''
+	return JSONResponse(
+		{"detail": "Server busy. Retry shortly"},
+		status_code=HTTP_503_SERVICE_UNAVAILABLE,
+		headers={"Retry-After": "1"}
+	)
@@ -0,0 +1,219 @@
+'''
+FastAPI Demo
+
+Prometheus metrics
+'''
+# Standard Imports
+import os
+import threading
+import time
+
+# PyPi Imports
+import anyio.to_thread
+from prometheus_client import (
+	CONTENT_TYPE_LATEST,
+	CollectorRegistry,
+	Counter,
+	Gauge,
+	Histogram,
+	REGISTRY,
+	generate_latest,
+	multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.pool import (
+	AsyncAdaptedQueuePool,
+	QueuePool
+)
+from starlette.requests import Request
+from starlette.routing import Match
+
+# Local Imports
+from utils.config_utils import get_config
+
+###############################################################################
+
+CONFIG = get_config('api.cfg')
+METRICS_ENABLED = CONFIG.getboolean('metrics', 'ENABLED', fallback=True)
+METRICS_PATH = CONFIG.get('metrics', 'PATH', fallback='/metrics')
+METRICS_TOKEN = CONFIG.get('metrics', 'TOKEN', fallback='')
+
+# Set by the process manager before the workers start; every worker then writes
+# its samples to this directory and any worker can serve the combined view.
+MULTIPROCESS_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+###############################################################################
+
+REQUEST_LATENCY = Histogram(
+	'http_request_duration_seconds',
+	'Time from receiving a request until its response starts',
+	['method', 'route']
+)
+REQUEST_COUNT = Counter(
+	'http_requests',
+	'Requests served, by route and status code',
+	['method', 'route', 'status']
+)
+REQUESTS_IN_FLIGHT = Gauge(
+	'http_requests_in_flight',
+	'Requests currently being handled',
+	multiprocess_mode='livesum'
+)
+DB_POOL_CHECKED_OUT = Gauge(
+	'db_pool_checked_out_connections',
+	'Database connections currently checked out of the pool',
+	['engine'],
+	multiprocess_mode='livesum'
+)
+DB_POOL_OVERFLOW = Gauge(
+	'db_pool_overflow_connections',
+	'Database connections open beyond the pool size',
+	['engine'],
+	multiprocess_mode='livesum'
+)
+DB_POOL_WAIT = Histogram(
+	'db_pool_wait_seconds',
+	'Time spent waiting to check a connection out of the pool',
+	['engine'],
+	buckets=(.0005, .001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+)
+PASSWORD_HASH_DURATION = Histogram(
+	'password_hash_duration_seconds',
+	'Time spent hashing or verifying a password',
+	['operation'],
+	buckets=(.01, .025, .05, .1, .2, .3, .5, .75, 1, 2.5, 5)
+)
+JWT_OPERATIONS = Counter(
+	'jwt_operations',
+	'JWTs encoded or decoded',
+	['operation']
+)
+CACHE_HITS = Counter(
+	'cache_hits',
+	'Lookups answered from an in-process cache',
+	['cache']
+)
+CACHE_MISSES = Counter(
+	'cache_misses',
+	'Lookups an in-process cache could not answer',
+	['cache']
+)
+CACHE_EVICTIONS = Counter(
+	'cache_evictions',
+	'Entries dropped from a full in-process cache to make room',
+	['cache']
+)
+THREADPOOL_BUSY = Gauge(
+	'threadpool_busy_threads',
+	'Worker threads running sync endpoints and dependencies',
+	multiprocess_mode='livesum'
+)
+THREADPOOL_QUEUE_DEPTH = Gauge(
+	'threadpool_queue_depth',
+	'Sync endpoints and dependencies waiting for a worker thread',
+	multiprocess_mode='livesum'
+)
+
+###############################################################################
+
+class PoolMetricsMixin:
+	'''Times how long callers wait to check a connection out of a queue pool'''
+	metrics_engine = 'sync'
+
+	def connect(self):
+		'''Check a connection out, timing how long the caller waited for it'''
+		start = time.perf_counter()
+		try:
+			return super().connect()
+		finally:
+			DB_POOL_WAIT.labels(self.metrics_engine).observe(time.perf_counter() - start)
+
+
+class MeteredQueuePool(PoolMetricsMixin, QueuePool):
+	'''QueuePool for the sync engine that publishes pool metrics'''
+	metrics_engine = 'sync'
+
+
+class MeteredAsyncAdaptedQueuePool(PoolMetricsMixin, AsyncAdaptedQueuePool):
+	'''AsyncAdaptedQueuePool for the async engine that publishes pool metrics'''
+	metrics_engine = 'async'
+
+
+class PoolUsageListener:
+	'''Tracks an engine's checked out and open connections through the public pool events'''
+	def __init__(self, engine):
+		self.engine = engine
+		self.label = getattr(engine.pool, 'metrics_engine', 'sync')
+		self.open_connections = 0
+		self._lock = threading.Lock()
+		event.listen(engine, 'checkout', self.checkout)
+		event.listen(engine, 'checkin', self.checkin)
+		event.listen(engine, 'connect', self.connect)
+		event.listen(engine, 'close', self.close)
+		event.listen(engine, 'detach', self.close)
+
+	def checkout(self, dbapi_connection, connection_record, connection_proxy): #pylint: disable=unused-argument
+		'''A connection left the pool'''
+		DB_POOL_CHECKED_OUT.labels(self.label).inc()
+
+	def checkin(self, dbapi_connection, connection_record): #pylint: disable=unused-argument
+		'''A connection came back to the pool'''
+		DB_POOL_CHECKED_OUT.labels(self.label).dec()
+
+	def connect(self, dbapi_connection, connection_record): #pylint: disable=unused-argument
+		'''The pool opened a new database connection'''
+		self._count_open(1)
+
+	def close(self, dbapi_connection, connection_record): #pylint: disable=unused-argument
+		'''The pool closed or let go of a database connection'''
+		self._count_open(-1)
+
+	def _count_open(self, change: int):
+		'''Publish how far the open connections exceed the pool size'''
+		with self._lock:
+			self.open_connections += change
+			overflow = max(self.open_connections - self.engine.pool.size(), 0)
+		DB_POOL_OVERFLOW.labels(self.label).set(overflow)
+
+###############################################################################
+
+def route_template(request: Request):
+	'''Return the path template of the route that served a request, keeping label cardinality bounded'''
+	for route in request.app.router.routes:
+		match, _ = route.matches(request.scope)
+		if match == Match.FULL:
+			return route.path
+	return 'unmatched'
+
+def record_threadpool_usage():
+	'''Publish how busy the threadpool that runs sync endpoints is'''
+	statistics = anyio.to_thread.current_default_thread_limiter().statistics()
+	THREADPOOL_BUSY.set(statistics.borrowed_tokens)
+	THREADPOOL_QUEUE_DEPTH.set(statistics.tasks_waiting)
+
+async def record_request(request: Request, call_next):
+	'''Time the request and count its outcome'''
+	if request.url.path == METRICS_PATH:
+		return await call_next(request)
+	status = 500
+	REQUESTS_IN_FLIGHT.inc()
+	record_threadpool_usage()
+	start = time.perf_counter()
+	try:
+		response = await call_next(request)
+		status = response.status_code
+		return response
+	finally:
+		route = route_template(request)
+		REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - start)
+		REQUEST_COUNT.labels(request.method, route, str(status)).inc()
+		REQUESTS_IN_FLIGHT.dec()
+		record_threadpool_usage()
+
+def render_metrics():
+	'''Return the exposition text, combined across workers when running multiprocess'''
+	if MULTIPROCESS_DIR:
+		registry = CollectorRegistry()
+		multiprocess.MultiProcessCollector(registry)
+		return generate_latest(registry), CONTENT_TYPE_LATEST
+	return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
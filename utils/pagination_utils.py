@@ -0,0 +1,27 @@
+'''
+FastAPI Demo
+
+Pagination utils
+'''
+# Standard Imports
+import base64
+import binascii
+import json
+
+###############################################################################
+
+def encode_cursor(user_id: int):
+	'''Build an opaque cursor pointing just past user_id'''
+	raw = json.dumps({'after': user_id}, separators=(',', ':')).encode('utf-8')
+	return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str):
+	'''Return the user_id a cursor points past, raising ValueError if it is not one of ours'''
+	try:
+		raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+		after = json.loads(raw.decode('utf-8'))['after']
+	except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+		raise ValueError('Not a valid pagination cursor')
+	if not isinstance(after, int) or isinstance(after, bool):
+		raise ValueError('Not a valid pagination cursor')
+	return after
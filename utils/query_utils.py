@@ -0,0 +1,170 @@
+'''
+FastAPI Demo
+
+Per-request SQL query accounting
+'''
+# Standard Imports
+from collections import Counter
+import contextlib
+import contextvars
+import logging
+import time
+
+# PyPi Imports
+from sqlalchemy import event
+from starlette.requests import Request
+
+# Local Imports
+from database.setup import (
+	async_engine,
+	engine
+)
+from utils.config_utils import get_config
+
+###############################################################################
+
+CONFIG = get_config('api.cfg')
+QUERY_ACCOUNTING_ENABLED = CONFIG.getboolean('queries', 'ENABLED', fallback=True)
+SERVER_TIMING = CONFIG.getboolean('queries', 'SERVER_TIMING', fallback=True)
+# A statement run this many times with different parameters in one request looks like an N+1
+REPEATED_STATEMENT_THRESHOLD = CONFIG.getint('queries', 'REPEATED_STATEMENT_THRESHOLD', fallback=5)
+
+LOGGER = logging.getLogger(__name__)
+
+###############################################################################
+
+class QueryBudgetExceededError(AssertionError):
+	'''Raised when a block runs more queries than its budget allows'''
+
+
+class QueryLog:
+	'''Statements run, and the time they took, within one request or budget block'''
+	def __init__(self):
+		self.count = 0
+		self.duration = 0.0
+		self.statements = Counter()
+		self.executions = Counter()
+
+	def record(self, statement: str, parameters, executemany: bool, duration: float):
+		'''Account for one executed statement'''
+		self.count += 1
+		self.duration += duration
+		self.statements[statement] += 1
+		if not executemany:
+			self.executions[(statement, repr(parameters))] += 1
+
+	def duplicates(self):
+		'''Return (statement, count) for statements run more than once with the same parameters'''
+		duplicates = Counter()
+		for (statement, _), count in self.executions.items():
+			if count > 1:
+				duplicates[statement] += count
+		return list(duplicates.items())
+
+	def repeated(self, threshold: int = REPEATED_STATEMENT_THRESHOLD):
+		'''Return (statement, count) for statements run with at least threshold different parameter sets'''
+		variants = Counter(statement for statement, _ in self.executions)
+		return [(statement, count) for statement, count in variants.items() if count >= threshold]
+
+	def server_timing(self):
+		'''Render the totals as a Server-Timing metric'''
+		return 'db;dur={duration:.1f};desc="{count} queries"'.format(duration=self.duration * 1000, count=self.count)
+
+
+_REQUEST_LOG = contextvars.ContextVar('request_query_log', default=None)
+# Budgets are watched from the test thread while requests run elsewhere, so they are not context-local
+_BUDGETS = []
+
+###############################################################################
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany): #pylint: disable=unused-argument,too-many-arguments
+	'''Note when a statement starts'''
+	if context is not None:
+		context.query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany): #pylint: disable=unused-argument,too-many-arguments
+	'''Charge a finished statement to the current request and any open budgets'''
+	started = getattr(context, 'query_started', None)
+	duration = time.perf_counter() - started if started is not None else 0.0
+	request_log = _REQUEST_LOG.get()
+	if request_log is not None:
+		request_log.record(statement, parameters, executemany, duration)
+	for budget_log in _BUDGETS:
+		budget_log.record(statement, parameters, executemany, duration)
+
+for _engine in (engine, async_engine.sync_engine):
+	event.listen(_engine, 'before_cursor_execute', _before_cursor_execute)
+	event.listen(_engine, 'after_cursor_execute', _after_cursor_execute)
+
+###############################################################################
+
+def report_queries(request: Request, query_log: QueryLog):
+	'''Log a request's query totals, warning about redundant and N+1 shaped statements'''
+	LOGGER.info(
+		'%s %s ran %d queries in %.1f ms',
+		request.method,
+		request.url.path,
+		query_log.count,
+		query_log.duration * 1000
+	)
+	for statement, count in query_log.duplicates():
+		LOGGER.warning(
+			'%s %s ran an identical statement %d times: %s',
+			request.method,
+			request.url.path,
+			count,
+			statement
+		)
+	for statement, count in query_log.repeated():
+		LOGGER.warning(
+			'%s %s ran a statement %d times, possible N+1: %s',
+			request.method,
+			request.url.path,
+			count,
+			statement
+		)
+
+async def account_queries(request: Request, call_next):
+	'''Count and time the request's SQL, reporting it in a Server-Timing header and the logs'''
+	if not QUERY_ACCOUNTING_ENABLED:
+		return await call_next(request)
+	query_log = QueryLog()
+	token = _REQUEST_LOG.set(query_log)
+	try:
+		response = await call_next(request)
+	finally:
+		_REQUEST_LOG.reset(token)
+		report_queries(request, query_log)
+	if SERVER_TIMING:
+		response.headers.append('Server-Timing', query_log.server_timing())
+	return response
+
+@contextlib.contextmanager
+def query_budget(max_queries: int, allow_duplicates: bool = True):
+	'''Fail if the block runs more than max_queries statements, or any identical statement twice if not allowed'''
+	budget_log = QueryLog()
+	_BUDGETS.append(budget_log)
+	try:
+		yield budget_log
+	finally:
+		_BUDGETS.remove(budget_log)
+	if budget_log.count > max_queries:
+		raise QueryBudgetExceededError(
+			'{count} queries run against a budget of {max_queries}:\n{statements}'.format(
+				count=budget_log.count,
+				max_queries=max_queries,
+				statements='\n'.join(
+					'{count} x {statement}'.format(count=count, statement=statement)
+					for statement, count in budget_log.statements.items()
+				)
+			)
+		)
+	if not allow_duplicates and budget_log.duplicates():
+		raise QueryBudgetExceededError(
+			'Identical statements run more than once:\n{statements}'.format(
+				statements='\n'.join(
+					'{count} x {statement}'.format(count=count, statement=statement)
+					for statement, count in budget_log.duplicates()
+				)
+			)
+		)
@@ -0,0 +1,148 @@
+'''
+FastAPI Demo
+
+Login admission control
+'''
+# Standard Imports
+import asyncio
+from collections import OrderedDict
+import contextlib
+import threading
+import time
+
+# Local Imports
+from utils.config_utils import get_config
+
+###############################################################################
+
+CONFIG = get_config('security.cfg')
+SECURITY = CONFIG['security']
+
+###############################################################################
+
+class LoginBusyError(Exception):
+	'''Raised when no password verification slot frees up in time'''
+
+
+class MemoryRateLimitBackend:
+	'''Token buckets held in this process'''
+	def __init__(self, max_keys: int = 100000):
+		self.max_keys = max_keys
+		self._buckets = OrderedDict()
+		self._lock = threading.Lock()
+
+	async def take(self, key: str, capacity: float, refill_rate: float):
+		'''Take one token from a bucket, returning 0 if allowed or the seconds until a token is available'''
+		now = time.monotonic()
+		with self._lock:
+			tokens, updated = self._buckets.pop(key, (capacity, now))
+			tokens = min(capacity, tokens + (now - updated) * refill_rate)
+			retry_after = 0.0
+			if tokens >= 1:
+				tokens -= 1
+			else:
+				retry_after = (1 - tokens) / refill_rate
+			self._buckets[key] = (tokens, now)
+			while len(self._buckets) > self.max_keys:
+				self._buckets.popitem(last=False)
+		return retry_after
+
+	def clear(self):
+		'''Refill every bucket'''
+		with self._lock:
+			self._buckets.clear()
+
+
+class RedisRateLimitBackend:
+	'''Token buckets shared between workers and hosts through Redis'''
+	TAKE_SCRIPT = '''
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * refill_rate)
+local retry_after = 0
+if tokens >= 1 then
+	tokens = tokens - 1
+else
+	retry_after = (1 - tokens) / refill_rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill_rate) + 1)
+return tostring(retry_after)
+'''
+
+	def __init__(self, url: str, prefix: str = 'login_rate:'):
+		import redis.asyncio # pylint: disable=import-outside-toplevel
+		self.prefix = prefix
+		self._client = redis.asyncio.from_url(url)
+		self._take = self._client.register_script(self.TAKE_SCRIPT)
+
+	async def take(self, key: str, capacity: float, refill_rate: float):
+		'''Take one token from a bucket, returning 0 if allowed or the seconds until a token is available'''
+		return float(await self._take(keys=[self.prefix + key], args=[capacity, refill_rate]))
+
+
+class LoginAdmission:
+	'''Per-IP and per-username token buckets plus a bound on concurrent password verifications'''
+	def __init__(
+		self,
+		backend,
+		ip_capacity: float,
+		ip_refill_rate: float,
+		username_capacity: float,
+		username_refill_rate: float,
+		max_verifications: int,
+		verification_timeout: float
+	):
+		self.backend = backend
+		self.ip_capacity = ip_capacity
+		self.ip_refill_rate = ip_refill_rate
+		self.username_capacity = username_capacity
+		self.username_refill_rate = username_refill_rate
+		self.max_verifications = max_verifications
+		self.verification_timeout = verification_timeout
+		self._semaphore = None
+
+	async def check(self, client_ip: str, username: str):
+		'''Return 0 if the attempt may proceed, otherwise the seconds the client should wait'''
+		retry_after = await self.backend.take('ip:' + client_ip, self.ip_capacity, self.ip_refill_rate)
+		if retry_after:
+			return retry_after
+		return await self.backend.take('user:' + username, self.username_capacity, self.username_refill_rate)
+
+	@contextlib.asynccontextmanager
+	async def verification_slot(self):
+		'''Hold one of the max_verifications slots, raising LoginBusyError if none frees up in time'''
+		if self._semaphore is None:
+			self._semaphore = asyncio.Semaphore(self.max_verifications)
+		# asyncio.timeout cancels the acquire itself, so a permit granted as the deadline passes is never leaked
+		try:
+			async with asyncio.timeout(self.verification_timeout):
+				await self._semaphore.acquire()
+		except TimeoutError:
+			raise LoginBusyError()
+		try:
+			yield
+		finally:
+			self._semaphore.release()
+
+###############################################################################
+
+if SECURITY.get('LOGIN_RATE_LIMIT_BACKEND', 'memory') == 'redis':
+	RATE_LIMIT_BACKEND = RedisRateLimitBackend(SECURITY['LOGIN_RATE_LIMIT_REDIS_URL'])
+else:
+	RATE_LIMIT_BACKEND = MemoryRateLimitBackend()
+
+LOGIN_ADMISSION = LoginAdmission(
+	backend=RATE_LIMIT_BACKEND,
+	ip_capacity=SECURITY.getfloat('LOGIN_IP_BURST', 20),
+	ip_refill_rate=SECURITY.getfloat('LOGIN_IP_PER_SECOND', 1),
+	username_capacity=SECURITY.getfloat('LOGIN_USERNAME_BURST', 10),
+	username_refill_rate=SECURITY.getfloat('LOGIN_USERNAME_PER_SECOND', 0.2),
+	max_verifications=SECURITY.getint('LOGIN_MAX_CONCURRENT_VERIFICATIONS', 8),
+	verification_timeout=SECURITY.getfloat('LOGIN_VERIFICATION_TIMEOUT_SECONDS', 2)
+)
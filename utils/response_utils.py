@@ -0,0 +1,41 @@
+'''
+FastAPI Demo
+
+Response utils
+'''
+# PyPi Imports
+import orjson
+from starlette.responses import Response
+
+# Local Imports
+from utils.config_utils import get_config
+from utils.user_utils import USER_FIELDS
+
+###############################################################################
+
+CONFIG = get_config('api.cfg')
+FAST_JSON_RESPONSES = CONFIG.getboolean('api', 'FAST_JSON_RESPONSES', fallback=False)
+
+###############################################################################
+
+def parse_fields(fields: str):
+	'''Turn a ?fields=user_id,username parameter into a tuple of field names, raising ValueError on unknown fields'''
+	if not fields:
+		return None
+	names = tuple(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+	if not names or any(name not in USER_FIELDS for name in names):
+		raise ValueError('Unknown user field')
+	return names
+
+def encode_user_rows(rows, fields=USER_FIELDS):
+	'''Encode user rows (tuples starting with fields, in order) straight to JSON bytes, skipping pydantic'''
+	return orjson.dumps([dict(zip(fields, row)) for row in rows])
+
+def fast_users_response(rows, headers: dict = None, fields=None):
+	'''JSON response for a list of user rows that bypasses response_model validation'''
+	return Response(encode_user_rows(rows, fields or USER_FIELDS), media_type='application/json', headers=headers)
+
+def fast_user_response(row, headers: dict = None, fields=None):
+	'''JSON response for a single user row that bypasses response_model validation'''
+	content = orjson.dumps(dict(zip(fields or USER_FIELDS, row)))
+	return Response(content, media_type='application/json', headers=headers)
@@ -0,0 +1,79 @@
+'''
+FastAPI Demo
+
+Token revocation utils
+'''
+# Standard Imports
+import asyncio
+import time
+
+# PyPi Imports
+from sqlalchemy import select
+
+# Local Imports
+from database import models
+from utils.config_utils import get_config
+
+###############################################################################
+
+CONFIG = get_config('security.cfg')
+SECURITY = CONFIG['security']
+CLAIMS_AUTHORIZATION = SECURITY.getboolean('CLAIMS_AUTHORIZATION', False)
+
+###############################################################################
+
+class RevocationTable:
+	'''Periodically refreshed, in-process copy of the token_revocations table'''
+	def __init__(self, refresh_interval: float):
+		self.refresh_interval = refresh_interval
+		self._generations = dict()
+		self._loaded_at = None
+		self._refresh = None
+
+	def generation(self, user_id: int):
+		'''The current token generation of a user'''
+		return self._generations.get(user_id, 0)
+
+	def record(self, user_id: int, generation: int):
+		'''Apply a generation bump made by this process without waiting for a refresh'''
+		if generation > self.generation(user_id):
+			self._generations[user_id] = generation
+
+	def is_revoked(self, user_id: int, token_generation: int):
+		'''Whether a token issued at token_generation has since been revoked'''
+		return token_generation < self.generation(user_id)
+
+	def is_stale(self):
+		'''Whether the table is due for a refresh'''
+		return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_interval
+
+	async def refresh_if_stale(self, session_factory):
+		'''Reload the table if it is due; callers wait for the first load, later ones keep using the current copy'''
+		if not self.is_stale():
+			return
+		if self._refresh is None or self._refresh.done():
+			self._refresh = asyncio.ensure_future(self._load(session_factory))
+		if self._loaded_at is None:
+			await asyncio.shield(self._refresh)
+
+	async def _load(self, session_factory):
+		'''Read the whole table on a session of its own, since the load outlives the request that started it'''
+		database = session_factory()
+		try:
+			result = await database.execute(
+				select(models.TokenRevocation.user_id, models.TokenRevocation.token_generation)
+			)
+			for user_id, generation in result:
+				self.record(user_id, generation)
+			self._loaded_at = time.monotonic()
+		finally:
+			await database.close()
+
+	def clear(self):
+		'''Forget every generation and force a reload'''
+		self._generations = dict()
+		self._loaded_at = None
+		self._refresh = None
+
+
+REVOCATIONS = RevocationTable(refresh_interval=SECURITY.getint('REVOCATION_REFRESH_SECONDS', 5))
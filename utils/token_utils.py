@@ -11,6 +11,8 @@ import jwt
 
 # Local Imports
 from utils.config_utils import get_config
+from utils.metrics_utils import JWT_OPERATIONS
+from utils.tracing_utils import start_span
 
 ###############################################################################
 
@@ -24,5 +26,7 @@ def create_access_token(*, data: dict, expires_delta: timedelta = None):
 	to_encode = data.copy()
 	expire = datetime.utcnow() + expires_delta if expires_delta else timedelta(minutes=15)
 	to_encode.update({"exp": expire})
-	encoded_jwt = jwt.encode(to_encode, SECURITY['SECRET_KEY'], algorithm=SECURITY['ALGORITHM'])
+	JWT_OPERATIONS.labels('encode').inc()
+	with start_span('jwt.encode'):
+		encoded_jwt = jwt.encode(to_encode, SECURITY['SECRET_KEY'], algorithm=SECURITY['ALGORITHM'])
 	return encoded_jwt
@@ -0,0 +1,241 @@
+'''
+FastAPI Demo
+
+Request tracing
+'''
+# Standard Imports
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+
+# PyPi Imports
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.requests import Request
+try:
+	from opentelemetry import trace
+	from opentelemetry.sdk.resources import Resource
+	from opentelemetry.sdk.trace import TracerProvider
+	from opentelemetry.sdk.trace.export import (
+		BatchSpanProcessor,
+		ConsoleSpanExporter
+	)
+	from opentelemetry.sdk.trace.sampling import (
+		ParentBased,
+		TraceIdRatioBased
+	)
+	from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+except ImportError: # tracing is optional; without the SDK every span is a no-op
+	trace = None # pylint: disable=invalid-name
+
+# Local Imports
+from database.setup import (
+	async_engine,
+	engine
+)
+from utils.config_utils import get_config
+from utils.metrics_utils import route_template
+
+###############################################################################
+
+CONFIG = get_config('api.cfg')
+TRACING_ENABLED = CONFIG.getboolean('tracing', 'ENABLED', fallback=False) and trace is not None
+SERVICE_NAME = CONFIG.get('tracing', 'SERVICE_NAME', fallback='fastapi_demo')
+SAMPLE_RATE = CONFIG.getfloat('tracing', 'SAMPLE_RATE', fallback=1.0)
+EXPORTER = CONFIG.get('tracing', 'EXPORTER', fallback='file')
+FILE_PATH = CONFIG.get('tracing', 'FILE_PATH', fallback='traces.jsonl')
+OTLP_ENDPOINT = CONFIG.get('tracing', 'OTLP_ENDPOINT', fallback='http://127.0.0.1:4318/v1/traces')
+
+NO_SPAN = contextlib.nullcontext()
+
+###############################################################################
+
+if trace is not None:
+	class FileSpanExporter(ConsoleSpanExporter):
+		'''Append spans to a file as JSON lines, closing it when the provider shuts down'''
+		def __init__(self, path: str):
+			super().__init__(
+				out=open(path, 'a', encoding='utf-8'), #pylint: disable=consider-using-with
+				formatter=lambda span: span.to_json(indent=None) + os.linesep
+			)
+
+		def shutdown(self):
+			super().shutdown()
+			self.out.close()
+
+def build_exporter():
+	'''Build the span exporter named in the [tracing] config section'''
+	if EXPORTER == 'otlp':
+		from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter # pylint: disable=import-outside-toplevel
+		return OTLPSpanExporter(endpoint=OTLP_ENDPOINT)
+	return FileSpanExporter(FILE_PATH)
+
+def build_provider():
+	'''Build a tracer provider that samples SAMPLE_RATE of new traces and follows the caller's decision otherwise'''
+	provider = TracerProvider(
+		resource=Resource.create({'service.name': SERVICE_NAME}),
+		sampler=ParentBased(TraceIdRatioBased(SAMPLE_RATE))
+	)
+	provider.add_span_processor(BatchSpanProcessor(build_exporter()))
+	return provider
+
+TRACER = None
+PROPAGATOR = None
+PROVIDER = None
+
+# The dependency and serialization spans of the route call in progress
+_ROUTE_SPANS = contextvars.ContextVar('route_spans', default=None)
+
+###############################################################################
+
+def start_span(name: str, attributes: dict = None):
+	'''Return a context manager for a child span of the current span, or a no-op when tracing is off'''
+	if TRACER is None:
+		return NO_SPAN
+	return TRACER.start_as_current_span(name, attributes=attributes)
+
+def traced(name: str = None):
+	'''Decorate a function, sync or async, so each call runs in its own span while tracing is on'''
+	def decorator(function):
+		span_name = name or function.__name__
+		if asyncio.iscoroutinefunction(function):
+			@functools.wraps(function)
+			async def async_wrapper(*args, **kwargs):
+				if TRACER is None:
+					return await function(*args, **kwargs)
+				with TRACER.start_as_current_span(span_name):
+					return await function(*args, **kwargs)
+			return async_wrapper
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			if TRACER is None:
+				return function(*args, **kwargs)
+			with TRACER.start_as_current_span(span_name):
+				return function(*args, **kwargs)
+		return wrapper
+	return decorator
+
+def _end_route_span(name: str):
+	'''End one of the current route call's open spans'''
+	spans = _ROUTE_SPANS.get()
+	if spans is not None and name in spans:
+		spans.pop(name).end()
+
+def _start_route_span(name: str):
+	'''Open a span for a stage of the current route call, ended by the route handler at the latest'''
+	spans = _ROUTE_SPANS.get()
+	if spans is not None and TRACER is not None:
+		spans[name] = TRACER.start_span(name)
+
+def _mark_endpoint(endpoint):
+	'''Wrap an endpoint so its call ends the dependency span and its return starts the serialization span'''
+	if getattr(endpoint, 'route_spans', False):
+		return endpoint
+	if asyncio.iscoroutinefunction(endpoint):
+		@functools.wraps(endpoint)
+		async def async_wrapper(*args, **kwargs):
+			_end_route_span('solve_dependencies')
+			result = await endpoint(*args, **kwargs)
+			_start_route_span('serialize_response')
+			return result
+		async_wrapper.route_spans = True
+		return async_wrapper
+	@functools.wraps(endpoint)
+	def wrapper(*args, **kwargs):
+		_end_route_span('solve_dependencies')
+		result = endpoint(*args, **kwargs)
+		_start_route_span('serialize_response')
+		return result
+	wrapper.route_spans = True
+	return wrapper
+
+class TracedAPIRoute(APIRoute):
+	'''APIRoute with spans for resolving every dependency (body and form parsing included) and for serializing the response'''
+	def __init__(self, path: str, endpoint, **kwargs):
+		super().__init__(path, _mark_endpoint(endpoint), **kwargs)
+
+	def get_route_handler(self):
+		handler = super().get_route_handler()
+		async def traced_handler(request: Request):
+			if TRACER is None:
+				return await handler(request)
+			spans = {'solve_dependencies': TRACER.start_span('solve_dependencies')}
+			token = _ROUTE_SPANS.set(spans)
+			try:
+				return await handler(request)
+			finally:
+				_ROUTE_SPANS.reset(token)
+				for span in spans.values():
+					span.end()
+		return traced_handler
+
+async def trace_request(request: Request, call_next):
+	'''Run the request in a server span, continuing the trace from an incoming W3C traceparent header'''
+	if TRACER is None:
+		return await call_next(request)
+	parent = PROPAGATOR.extract(carrier=request.headers)
+	with TRACER.start_as_current_span(
+		'{method} {path}'.format(method=request.method, path=request.url.path),
+		context=parent,
+		kind=trace.SpanKind.SERVER,
+		attributes={'http.method': request.method, 'http.target': request.url.path}
+	) as span:
+		response = await call_next(request)
+		route = route_template(request)
+		span.update_name('{method} {route}'.format(method=request.method, route=route))
+		span.set_attribute('http.route', route)
+		span.set_attribute('http.status_code', response.status_code)
+		return response
+
+###############################################################################
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany): #pylint: disable=unused-argument,too-many-arguments
+	'''Open a span for a statement'''
+	if context is not None:
+		context.trace_span = TRACER.start_span(
+			'SQL ' + statement.split(None, 1)[0].upper(),
+			kind=trace.SpanKind.CLIENT,
+			attributes={'db.system': 'postgresql', 'db.statement': statement}
+		)
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany): #pylint: disable=unused-argument,too-many-arguments
+	'''Close a statement's span'''
+	span = getattr(context, 'trace_span', None)
+	if span is not None:
+		span.end()
+
+def _handle_error(exception_context):
+	'''Close a failed statement's span, recording the error'''
+	span = getattr(exception_context.execution_context, 'trace_span', None)
+	if span is not None:
+		span.record_exception(exception_context.original_exception)
+		span.set_status(trace.Status(trace.StatusCode.ERROR))
+		span.end()
+
+SQL_LISTENERS = (
+	('before_cursor_execute', _before_cursor_execute),
+	('after_cursor_execute', _after_cursor_execute),
+	('handle_error', _handle_error)
+)
+
+def set_tracer(tracer, provider=None):
+	'''Send spans to tracer, with a span per SQL statement, or turn tracing off with None; a replaced provider is shut down'''
+	global TRACER, PROPAGATOR, PROVIDER #pylint: disable=global-statement
+	if PROVIDER is not None and PROVIDER is not provider:
+		PROVIDER.shutdown()
+	TRACER = tracer
+	PROPAGATOR = TraceContextTextMapPropagator() if tracer is not None else None
+	PROVIDER = provider
+	for _engine in (engine, async_engine.sync_engine):
+		for identifier, listener in SQL_LISTENERS:
+			listening = event.contains(_engine, identifier, listener)
+			if tracer is not None and not listening:
+				event.listen(_engine, identifier, listener)
+			elif tracer is None and listening:
+				event.remove(_engine, identifier, listener)
+
+if TRACING_ENABLED:
+	_provider = build_provider() #pylint: disable=invalid-name
+	set_tracer(_provider.get_tracer(__name__), _provider)
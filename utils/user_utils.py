@@ -4,24 +4,126 @@ FastAPI Demo
 User utils
 '''
 # Standard Imports
+from typing import (
+	List,
+	NamedTuple
+)
 
 # PyPi Imports
 from passlib.context import CryptContext
+from sqlalchemy import (
+	Integer,
+	any_,
+	case,
+	func,
+	literal,
+	or_,
+	update
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 # Local Imports
 from database import models
 from data_schemas import schemas
+from utils import hash_utils
+from utils.cache_utils import TTLCache
+from utils.config_utils import get_config
+from utils.metrics_utils import PASSWORD_HASH_DURATION
+from utils.revocation_utils import (
+	CLAIMS_AUTHORIZATION,
+	REVOCATIONS
+)
+from utils.tracing_utils import start_span
 
 ###############################################################################
 
+CONFIG = get_config('security.cfg')
+SECURITY = CONFIG['security']
+
 PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Per-process cache of the fields check_current_user needs. Writes through these
+# helpers invalidate it immediately; other workers see changes after the TTL.
+USER_AUTH_CACHE = TTLCache(
+	name='user_auth',
+	max_size=SECURITY.getint('AUTH_CACHE_SIZE', 1024),
+	ttl=SECURITY.getint('AUTH_CACHE_TTL_SECONDS', 30)
+)
+
+###############################################################################
+
+# The columns exposed through the API, in schemas.User field order
+USER_COLUMNS = (
+	models.User.username,
+	models.User.first_name,
+	models.User.last_name,
+	models.User.email,
+	models.User.user_id,
+	models.User.active_boolean,
+	models.User.admin_boolean
+)
+USER_FIELDS = tuple(column.key for column in USER_COLUMNS)
+# Returned by writes so that callers can build an ETag
+VERSIONED_USER_COLUMNS = USER_COLUMNS + (models.User.row_version,)
+
+BULK_INSERT_CHUNK_SIZE = 1000
+
+###############################################################################
+
+class UserSnapshot(NamedTuple):
+	'''The authorization relevant fields of a user'''
+	user_id: int
+	username: str
+	active_boolean: bool
+	admin_boolean: bool
+
+###############################################################################
+
+def bump_token_generations_statement(user_ids: List[int]):
+	'''Build the upsert that revokes every token issued to the given users so far'''
+	statement = insert(models.TokenRevocation).values([
+		{'user_id': user_id, 'token_generation': 1} for user_id in user_ids
+	])
+	return statement.on_conflict_do_update(
+		index_elements=[models.TokenRevocation.user_id],
+		set_={'token_generation': models.TokenRevocation.token_generation + 1}
+	).returning(models.TokenRevocation.user_id, models.TokenRevocation.token_generation)
+
+def bump_token_generations(database: Session, user_ids: List[int]):
+	'''Revoke the claims-based tokens of several users as part of the current transaction'''
+	if not CLAIMS_AUTHORIZATION or not user_ids:
+		return dict()
+	return dict(database.execute(bump_token_generations_statement(user_ids)).fetchall())
+
+def bump_token_generation(database: Session, user_id: int):
+	'''Revoke a user's claims-based tokens as part of the current transaction'''
+	return bump_token_generations(database, [user_id]).get(user_id)
+
+def forget_user_auth(user_id: int, generation: int = None):
+	'''Drop cached authorization state for a user once a change has committed'''
+	USER_AUTH_CACHE.invalidate(user_id)
+	if generation is not None:
+		REVOCATIONS.record(user_id, generation)
+
 ###############################################################################
 
-def get_user(database: Session, user_id: int):
-	'''Get a specific user by user_id'''
-	return database.query(models.User).filter(models.User.user_id == user_id).first()
+def user_columns(fields: tuple = None):
+	'''
+	Columns to select for the given public fields, in that order, followed by
+	user_id and row_version if they were not requested (cursors and ETags need them)
+	'''
+	fields = fields or USER_FIELDS
+	columns = [getattr(models.User, field) for field in fields]
+	for required in ('user_id', 'row_version'):
+		if required not in fields:
+			columns.append(getattr(models.User, required))
+	return columns
+
+def get_user(database: Session, user_id: int, fields: tuple = None):
+	'''Get a specific user by user_id, selecting only the requested public fields'''
+	return database.query(*user_columns(fields)).filter(models.User.user_id == user_id).first()
 
 def get_user_by_email(database: Session, email: str):
 	'''Get a specific user by email address'''
@@ -31,19 +133,57 @@ def get_user_by_username(database: Session, username: str):
 	'''Get a specific user by username'''
 	return database.query(models.User).filter(models.User.username == username).first()
 
-def get_users(database: Session, skip: int = 0, limit: int = 100):
-	'''Get a list of users'''
-	return database.query(models.User).offset(skip).limit(limit).all()
+def get_users(database: Session, skip: int = 0, limit: int = 100, after: int = None, fields: tuple = None):
+	'''Get a page of users ordered by user_id, starting after the given user_id'''
+	query = database.query(*user_columns(fields))
+	if after is not None:
+		query = query.filter(models.User.user_id > after)
+	query = query.order_by(models.User.user_id)
+	if skip:
+		query = query.offset(skip)
+	return query.limit(limit).all()
+
+def escape_like(term: str):
+	'''Escape LIKE wildcards so a search term only matches literally'''
+	return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_users(database: Session, query: str, skip: int = 0, limit: int = 20, fields: tuple = None):
+	'''Case-insensitive prefix and substring search over the searchable columns, best matches first'''
+	term = query.lower()
+	prefix = escape_like(term) + '%'
+	substring = '%' + escape_like(term) + '%'
+	lowered = {column: func.lower(getattr(models.User, column)) for column in models.USER_SEARCH_COLUMNS}
+	rank = case(
+		(lowered['username'] == term, 0),
+		(lowered['username'].like(prefix, escape='\\'), 1),
+		(or_(*(value.like(prefix, escape='\\') for value in lowered.values())), 2),
+		else_=3
+	)
+	similarity = func.greatest(*(func.similarity(value, term) for value in lowered.values()))
+	return database.query(*user_columns(fields)).filter(
+		or_(*(value.like(substring, escape='\\') for value in lowered.values()))
+	).order_by(
+		rank,
+		similarity.desc(),
+		models.User.user_id
+	).offset(skip).limit(limit).all()
+
+def stream_users(database: Session, batch_size: int = 1000):
+	'''Iterate over every user's public columns through a server-side cursor'''
+	query = database.query(*USER_COLUMNS).order_by(models.User.user_id)
+	return query.execution_options(stream_results=True).yield_per(batch_size)
 
 def hash_password(username: str, password: str):
 	'''Salt and hash a password'''
 	salted_password = password + username
-	return PWD_CONTEXT.hash(salted_password)
+	with start_span('bcrypt.hash'), PASSWORD_HASH_DURATION.labels('hash').time():
+		return PWD_CONTEXT.hash(salted_password)
 
 def verify_password(username: str, plain_password: str, hashed_password: str):
 	'''Verify a salted and hashed password against the username / password pair'''
 	salted_password = plain_password + username
-	return PWD_CONTEXT.verify(salted_password, hashed_password)
+	with start_span('bcrypt.verify'), PASSWORD_HASH_DURATION.labels('verify').time():
+		return PWD_CONTEXT.verify(salted_password, hashed_password)
 
 def authenticate_user(database: Session, username: str, password: str):
 	'''Authenticate a user'''
@@ -52,61 +192,156 @@ def authenticate_user(database: Session, username: str, password: str):
 	#print(PWD_CONTEXT.hash(salted_password))
 	if not user:
 		return False
-	if not verify_password(username, password, user.salted_password_hash):
+	if not hash_utils.run(verify_password, username, password, user.salted_password_hash):
 		return False
 	return user
 
 def create_user(database: Session, user: schemas.UserCreate):
-	'''Create a new user'''
-	db_user = models.User(
+	'''Create a new user, returning None if the username or email is already registered'''
+	statement = insert(models.User).values(
 		username=user.username,
 		first_name=user.first_name,
 		last_name=user.last_name,
 		email=user.email,
-		salted_password_hash=hash_password(user.username, user.password)
-	)
-	database.add(db_user)
+		salted_password_hash=hash_utils.run(hash_password, user.username, user.password)
+	).on_conflict_do_nothing()
+	db_user = database.execute(statement.returning(*VERSIONED_USER_COLUMNS)).first()
 	database.commit()
-	database.refresh(db_user)
 	return db_user
 
-def update_user(database: Session, user_id: int, data: schemas.UserUpdate):
-	'''Update a user'''
-	user = get_user(database=database, user_id=user_id)
-	if data.first_name:
-		user.first_name = data.first_name
-	if data.last_name:
-		user.last_name = data.last_name
-	if data.email:
-		user.email = data.email
-	database.add(user)
+def get_creation_conflict(database: Session, user: schemas.UserCreate):
+	'''Name the field ("username" or "email") that stops a user from being created'''
+	existing = database.query(models.User.username, models.User.email).filter(or_(
+		models.User.username == user.username,
+		models.User.email == user.email
+	)).all()
+	if any(row.username == user.username for row in existing):
+		return 'username'
+	if existing:
+		return 'email'
+	return None
+
+def create_users(database: Session, users: List[schemas.UserCreate]):
+	'''Create many users in one transaction, returning a result for every record'''
+	results = [{'index': index, 'username': user.username} for index, user in enumerate(users)]
+	existing = database.query(models.User.username, models.User.email).filter(or_(
+		models.User.username.in_({user.username for user in users}),
+		models.User.email.in_({user.email for user in users})
+	)).all()
+	taken_usernames = {row.username for row in existing}
+	taken_emails = {row.email for row in existing}
+	seen_usernames = set()
+	seen_emails = set()
+	candidates = []
+	for result, user in zip(results, users):
+		if user.username in taken_usernames:
+			result.update(status='conflict', detail='Username already registered')
+		elif user.email in taken_emails:
+			result.update(status='conflict', detail='Email already registered')
+		elif user.username in seen_usernames or user.email in seen_emails:
+			result.update(status='conflict', detail='Duplicate of an earlier record in this request')
+		else:
+			candidates.append((result, user))
+		seen_usernames.add(user.username)
+		seen_emails.add(user.email)
+	# End the read transaction so the connection goes back to the pool while the batch is hashed
+	database.commit()
+	password_hashes = hash_utils.run_many(hash_password, [(user.username, user.password) for _, user in candidates])
+	created = dict()
+	for start in range(0, len(candidates), BULK_INSERT_CHUNK_SIZE):
+		rows = [
+			{
+				'username': user.username,
+				'first_name': user.first_name,
+				'last_name': user.last_name,
+				'email': user.email,
+				'salted_password_hash': password_hash
+			}
+			for (_, user), password_hash in zip(
+				candidates[start:start + BULK_INSERT_CHUNK_SIZE],
+				password_hashes[start:start + BULK_INSERT_CHUNK_SIZE]
+			)
+		]
+		statement = insert(models.User).values(rows).on_conflict_do_nothing()
+		for row in database.execute(statement.returning(models.User.user_id, models.User.username)):
+			created[row.username] = row.user_id
 	database.commit()
+	for result, user in candidates:
+		if user.username in created:
+			result.update(status='created', user_id=created[user.username])
+		else:
+			result.update(status='conflict', detail='Username or email already registered')
+	return results
+
+def update_user_row(database: Session, user_id: int, revoke_tokens: bool = False, expected_version: int = None, **values):
+	'''Update one user with a single UPDATE ... RETURNING, returning None if there is no such user (at expected_version)'''
+	statement = update(models.User.__table__).where(models.User.user_id == user_id)
+	if expected_version is not None:
+		statement = statement.where(models.User.row_version == expected_version)
+	statement = statement.values(row_version=models.User.row_version + 1, **values)
+	user = database.execute(statement.returning(*VERSIONED_USER_COLUMNS)).first()
+	if user is None:
+		database.rollback()
+		return None
+	generation = bump_token_generation(database, user_id) if revoke_tokens else None
+	database.commit()
+	if revoke_tokens:
+		forget_user_auth(user_id, generation)
 	return user
 
+def update_user(database: Session, user_id: int, data: schemas.UserUpdate, expected_version: int = None):
+	'''Update a user, optionally only if it is still at expected_version'''
+	values = {
+		field: value for field, value in (
+			('first_name', data.first_name),
+			('last_name', data.last_name),
+			('email', data.email)
+		) if value
+	}
+	if not values:
+		user = get_user(database=database, user_id=user_id)
+		if user is None or expected_version not in (None, user.row_version):
+			return None
+		return user
+	return update_user_row(database, user_id, expected_version=expected_version, **values)
+
 def delete_user(database: Session, user_id: int):
 	'''Delete a user'''
-	user = get_user(database=database, user_id=user_id)
-	database.delete(user)
+	statement = models.User.__table__.delete().where(models.User.user_id == user_id)
+	user = database.execute(statement.returning(*VERSIONED_USER_COLUMNS)).first()
+	if user is None:
+		database.rollback()
+		return None
+	generation = bump_token_generation(database, user_id)
 	database.commit()
+	forget_user_auth(user_id, generation)
 	return user
 
 def set_password(database: Session, user_id: int, password: str):
 	'''Change a password'''
-	user = get_user(database=database, user_id=user_id)
-	user.salted_password_hash = hash_password(username=user.username, password=password)
-	database.add(user)
-	database.commit()
+	# The username salts the hash, so it has to be read before the update
+	username = database.query(models.User.username).filter(models.User.user_id == user_id).scalar()
+	if username is None:
+		return None
+	password_hash = hash_utils.run(hash_password, username, password)
+	return update_user_row(database, user_id, revoke_tokens=True, salted_password_hash=password_hash)
 
 def set_user_admin(database: Session, user_id: int, admin: bool):
 	'''Set the admin flag on a user'''
-	user = get_user(database=database, user_id=user_id)
-	user.admin_boolean = admin
-	database.add(user)
-	database.commit()
+	return update_user_row(database, user_id, revoke_tokens=True, admin_boolean=admin)
 
 def set_user_active(database: Session, user_id: int, active: bool):
-	'''Set the admin flag on a user'''
-	user = get_user(database=database, user_id=user_id)
-	user.active_boolean = active
-	database.add(user)
+	'''Set the active flag on a user'''
+	return update_user_row(database, user_id, revoke_tokens=True, active_boolean=active)
+
+def set_users_flag(database: Session, user_ids: List[int], **flags):
+	'''Set admin_boolean and/or active_boolean on many users with one statement, returning the ids updated'''
+	statement = update(models.User.__table__).where(
+		models.User.user_id == any_(literal(list(user_ids), ARRAY(Integer)))
+	).values(row_version=models.User.row_version + 1, **flags).returning(models.User.user_id)
+	updated = [row.user_id for row in database.execute(statement)]
+	generations = bump_token_generations(database, updated)
 	database.commit()
+	for user_id in updated:
+		forget_user_auth(user_id, generations.get(user_id))
+	return updated